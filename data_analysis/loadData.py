@@ -0,0 +1,76 @@
+'''
+Loads the merged study data (neurofit_data.csv) into a typed pandas
+dataframe, prepared the same way as the setup and "Modeling Number of
+Steps Taken" chunks of Report.Rmd, for the Python analysis scripts in
+this directory.
+
+One row per subject-day (the fMRI 'rating' row on message days),
+with the 1084/1109 exclusions, and:
+    type          -- valence_s_ns, or 'none' on days without a message
+    valence, s_ns -- 'none' on days without a message
+    msg_received  -- 1 on subject days 1-80
+    age           -- centered on the mean subject age (age_uncent is raw)
+    over50        -- 1 if age_uncent > 50
+    StepsLag1/2, self_efficacy_lag
+                  -- previous days' values, centered within subject
+Categorical columns use the pandas 'category' dtype, with 'none'
+as the first (reference) level of type, valence and s_ns.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+DATA_FILE = "neurofit_data.csv"
+
+COLUMNS = ["sub", "rating", "msg_start", "subj_day_num", "ActivityDate", "TotalSteps", "TotalDistance",
+           "msg_id", "valence", "s_ns", "self_efficacy_daily", "TotalMinutesAsleep", "age", "gender"]
+
+## Days the tracker was worn less than this are dropped, if the merge has wear time
+## (NA only for subjects without a heart-rate export, who are kept)
+MIN_WEAR_MINUTES = 600
+
+
+def centeredLag(data, col, lag):
+    '''
+    col from lag rows earlier for the same subject, minus its subject mean
+    '''
+    lagged = data.groupby('sub', observed=True)[col].shift(lag)
+    return lagged - lagged.groupby(data['sub'], observed=True).transform('mean')
+
+
+def loadModelData(path=DATA_FILE):
+    '''
+    Returns the typed subject-day dataframe described above
+    '''
+    raw = pd.read_csv(path)
+    raw = raw.loc[raw['trial_type'].isna() | (raw['trial_type'] == "rating")]
+    columns = COLUMNS + (["wear_minutes"] if "wear_minutes" in raw.columns else [])
+    data = raw[columns].copy()
+
+    data['msg_received'] = data['subj_day_num'].isin(range(1, 81)).astype(int)
+
+    activityDate = pd.to_datetime(data['ActivityDate'])
+    data = data.loc[~((data['sub'] == 1084) & (activityDate < "2019-11-01")) &
+                    ~((data['sub'] == 1109) & (activityDate > "2020-04-10"))]
+    if "wear_minutes" in data.columns:
+        data = data.loc[data['wear_minutes'].isna() | (data['wear_minutes'] >= MIN_WEAR_MINUTES)]
+
+    data['valence'] = data['valence'].fillna("none")
+    data['s_ns'] = data['s_ns'].fillna("none")
+    data['type'] = np.where(data['valence'] == "none", "none", data['valence'] + "_" + data['s_ns'])
+    for col in ['valence', 's_ns', 'type']:
+        levels = ["none"] + sorted(set(data[col]) - {"none"})
+        data[col] = pd.Categorical(data[col], categories=levels)
+    data['gender'] = data['gender'].astype('category')
+    data['sub'] = data['sub'].astype('category')
+
+    data['age_uncent'] = data['age']
+    data['age'] = data['age'] - data.groupby('sub', observed=True)['age'].median().mean()
+    data['over50'] = (data['age_uncent'] > 50).astype(int)
+
+    data['StepsLag1'] = centeredLag(data, 'TotalSteps', 1)
+    data['StepsLag2'] = centeredLag(data, 'TotalSteps', 2)
+    data['self_efficacy_lag'] = centeredLag(data, 'self_efficacy_daily', 1)
+
+    return data.reset_index(drop=True)
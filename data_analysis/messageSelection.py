@@ -0,0 +1,172 @@
+'''
+Personalized daily message selection by Thompson sampling over the
+health message pool (health_message_task/stimuli.csv), and an offline
+simulator to compare selection policies before deploying one.
+
+Model: the reward of sending message a to participant i is that day's
+steps minus the participant's baseline (mean steps before messaging).
+Each participant has an independent Gaussian belief about each
+message's mean reward, with
+    prior mean      type effect of the message's valence x s_ns
+                    + slope * (participant's fMRI rating of the message,
+                               centered on their mean rating)
+    prior variance  tau^2 (how much messages differ between people)
+and known day-to-day noise variance sigma^2. The type effects, rating
+slope and sigma are estimated from the merged data by calibrate().
+
+ThompsonSelector holds a whole cohort's beliefs as (participants x
+messages) arrays, so choosing and updating every participant's
+message for a day are single array operations.
+
+simulate() runs policies on synthetic participants, whose ratings are
+resampled from the real ones and whose true rewards are drawn from the
+same model, for any number of participants and days at once.
+
+Usage (from this directory):
+    python messageSelection.py --participants 5000 --days 90
+'''
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from loadData import loadModelData
+
+
+STIMULI_FILE = os.path.join("..", "health_message_task", "stimuli.csv")
+POLICIES = ['thompson', 'rating_greedy', 'random', 'schedule']
+
+
+def loadMessages(path=STIMULI_FILE):
+    '''
+    The message pool: id, valence, s_ns and type, in stimuli.csv order
+    '''
+    messages = pd.read_csv(path)[['valence', 's_ns', 'id']]
+    messages['type'] = messages['valence'] + "_" + messages['s_ns']
+    return messages.reset_index(drop=True)
+
+
+def calibrate(data, messages):
+    '''
+    Estimates the model's parameters from the merged data; returns a dict:
+        type_effect -- mean reward of each message's type (per message)
+        slope       -- reward per rating point above the participant's mean
+        sigma       -- SD of the reward around the model's mean
+        ratings     -- (real participants x messages) centered fMRI
+                       ratings, 0 where a participant didn't rate a message
+    '''
+    baseline = data.loc[data['msg_start'] == 0].groupby('sub', observed=True)['TotalSteps'].mean()
+    days = data.loc[data['msg_id'].notna() & data['type'].isin(messages['type'])].copy()
+    days['reward'] = days['TotalSteps'] - days['sub'].map(baseline).astype(float)
+    days = days.dropna(subset=['reward'])
+    days['rating_c'] = days['rating'] - days.groupby('sub', observed=True)['rating'].transform('mean')
+
+    typeMeans = days.groupby(days['type'].astype(str))['reward'].mean()
+    days['residual'] = days['reward'] - days['type'].astype(str).map(typeMeans)
+    rated = days.dropna(subset=['rating_c'])
+    slope = (rated['rating_c'] * rated['residual']).sum() / (rated['rating_c'] ** 2).sum()
+    sigma = (days['residual'] - slope * days['rating_c'].fillna(0)).std()
+
+    ratings = rated.pivot_table(index='sub', columns='msg_id', values='rating_c', observed=True)
+    ratings = ratings.reindex(columns=messages['id'].values).fillna(0)
+
+    return {'type_effect': messages['type'].map(typeMeans).fillna(0).values,
+            'slope': slope, 'sigma': sigma, 'ratings': ratings.values}
+
+
+class ThompsonSelector(object):
+    '''
+    Gaussian Thompson sampling for a cohort: one row per participant,
+    one column per message. max_sends limits how often one participant
+    gets the same message (None for no limit)
+    '''
+
+    def __init__(self, prior_mean, prior_sd, sigma, max_sends=None, seed=None):
+        self.precision = np.full(prior_mean.shape, 1.0 / prior_sd ** 2)
+        self.weighted = prior_mean * self.precision  ## precision * posterior mean
+        self.noise_precision = 1.0 / sigma ** 2
+        self.sends = np.zeros(prior_mean.shape, dtype=int)
+        self.max_sends = max_sends
+        self.rng = np.random.default_rng(seed)
+
+    def posteriorMean(self):
+        return self.weighted / self.precision
+
+    def choose(self):
+        '''
+        Index of the message to send each participant today
+        '''
+        draws = self.posteriorMean() + self.rng.standard_normal(self.precision.shape) / np.sqrt(self.precision)
+        if self.max_sends is not None:
+            draws[self.sends >= self.max_sends] = -np.inf
+        return draws.argmax(axis=1)
+
+    def update(self, chosen, rewards):
+        '''
+        Records each participant's reward (NaN if unobserved) for their chosen message
+        '''
+        rows = np.arange(len(chosen))
+        self.sends[rows, chosen] += 1
+        seen = ~np.isnan(rewards)
+        self.precision[rows[seen], chosen[seen]] += self.noise_precision
+        self.weighted[rows[seen], chosen[seen]] += rewards[seen] * self.noise_precision
+
+
+def priorMean(params, ratings):
+    return params['type_effect'][None, :] + params['slope'] * ratings
+
+
+def simulate(params, n_participants=1000, n_days=90, tau=500.0, policies=POLICIES, max_sends=None, seed=0):
+    '''
+    Mean reward per participant-day and regret against always sending
+    each participant's best message, for each policy, on the same
+    synthetic participants and noise
+    '''
+    rng = np.random.default_rng(seed)
+    realRatings = params['ratings']
+    ratings = realRatings[rng.integers(len(realRatings), size=n_participants)]
+    prior = priorMean(params, ratings)
+    truth = prior + tau * rng.standard_normal(prior.shape)
+    noise = params['sigma'] * rng.standard_normal((n_days, n_participants))
+    best = truth.max(axis=1).mean()
+    rows = np.arange(n_participants)
+    nMessages = truth.shape[1]
+
+    results = []
+    for policy in policies:
+        selector = ThompsonSelector(prior, tau, params['sigma'], max_sends, seed)
+        order = rng.permuted(np.tile(np.arange(nMessages), (n_participants, 1)), axis=1)
+        total = 0.0
+        for day in range(n_days):
+            if policy == 'thompson':
+                chosen = selector.choose()
+            elif policy == 'rating_greedy':
+                chosen = np.where(selector.sends < (max_sends or np.inf), prior, -np.inf).argmax(axis=1)
+            elif policy == 'random':
+                chosen = order[:, day % nMessages]
+            else:  ## The study's fixed schedule, in stimuli.csv order
+                chosen = np.full(n_participants, day % nMessages)
+            rewards = truth[rows, chosen] + noise[day]
+            selector.update(chosen, rewards)
+            total += rewards.sum()
+        mean = total / (n_participants * n_days)
+        results.append({'policy': policy, 'mean_reward': mean, 'regret_per_day': best - mean})
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate personalized message selection policies")
+    parser.add_argument('--data', default="neurofit_data.csv")
+    parser.add_argument('--participants', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--tau', type=float, default=500.0, help="SD of message effects between participants (steps)")
+    parser.add_argument('--max-sends', type=int, default=None, help="times one participant can get the same message")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    params = calibrate(loadModelData(args.data), loadMessages())
+    print("Rating slope %.1f steps/point, noise SD %.0f steps" % (params['slope'], params['sigma']))
+    table = simulate(params, args.participants, args.days, args.tau, max_sends=args.max_sends, seed=args.seed)
+    print(table.to_string(index=False, float_format=lambda x: '%.1f' % x))
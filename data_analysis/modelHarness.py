@@ -0,0 +1,211 @@
+'''
+Cross-validation and bootstrap refits of the Report.Rmd models,
+run in parallel over the merged data.
+
+Each model in MODELS is refit on every fold of two schemes:
+    lso   -- leave-subjects-out: subjects split into k groups, each
+             held out once
+    boot  -- cluster bootstrap: subjects drawn with replacement for
+             training; the subjects never drawn are the test set
+Held-out predictions use the fixed effects only (the test subjects
+are new to the model). Random-intercept linear models are fit with
+statsmodels' MixedLM (REML, as lmer); the logistic model with its
+variational Bayes mixed GLM (in place of glmer's Laplace fit).
+
+The data are loaded and typed once (loadData.py); worker processes
+get them at start-up, by fork where available, so the folds share one
+copy. Results are a tidy table with one row per model, fold and term
+(coefficients, and 'metric' rows for out-of-sample fit), summarized
+across folds at the end.
+
+Usage (from this directory):
+    python modelHarness.py --folds 6 --boots 200 --out cv_results.csv
+'''
+
+import argparse
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import patsy
+import statsmodels.formula.api as smf
+from statsmodels.genmod.bayes_mixed_glm import BinomialBayesMixedGLM
+
+from loadData import loadModelData
+
+
+## name: (formula, family, rows) -- rows is the subset of the data the model uses
+MODELS = {
+    'steps': ("TotalSteps ~ gender + age + self_efficacy_daily + type + StepsLag1 + StepsLag2",
+              'gaussian', 'all'),
+    'steps_se_lag': ("TotalSteps ~ gender + age + self_efficacy_daily + type + StepsLag1 + StepsLag2 + "
+                     "self_efficacy_lag", 'gaussian', 'all'),
+    'rating': ("rating ~ gender + age + valence * s_ns", 'gaussian', 'rated'),
+    'rating_above_avg': ("ratingAboveAvg ~ gender + age + valence * s_ns", 'binomial', 'rated'),
+}
+
+_data = None  ## Set in each worker by _shareData
+
+
+def _shareData(data):
+    global _data
+    _data = data
+
+
+def modelRows(data, rows):
+    '''
+    The rows a model is fit to: all of them, or (as data_no_na in
+    Report.Rmd) days with both a rating and a self-efficacy score
+    '''
+    if rows == 'rated':
+        data = data.dropna(subset=['rating', 'self_efficacy_daily']).copy()
+        data['valence'] = data['valence'].cat.remove_unused_categories()
+        data['s_ns'] = data['s_ns'].cat.remove_unused_categories()
+    return data
+
+
+def addRatingLabel(data, threshold):
+    '''
+    Adds ratingAboveAvg: 1 where the rating is above threshold
+    (the mean rating of the training rows, see fitFold)
+    '''
+    return data.assign(ratingAboveAvg=(data['rating'] > threshold).astype(int))
+
+
+def makeFolds(subjects, n_folds=6, n_boots=200, seed=0):
+    '''
+    List of (scheme, fold number, training subjects, test subjects);
+    bootstrap training subjects can repeat
+    '''
+    rng = np.random.RandomState(seed)
+    subjects = np.asarray(subjects)
+    folds = []
+    groups = np.array_split(rng.permutation(subjects), n_folds)
+    for i, test in enumerate(groups):
+        folds.append(('lso', i, np.setdiff1d(subjects, test), test))
+    for i in range(n_boots):
+        train = rng.choice(subjects, len(subjects), replace=True)
+        folds.append(('boot', i, train, np.setdiff1d(subjects, train)))
+    return folds
+
+
+def trainingRows(data, train):
+    '''
+    Rows of the training subjects; a subject drawn more than once
+    appears once per draw, as a separate cluster
+    '''
+    parts = []
+    for sub, count in pd.Series(train).value_counts().sort_index().items():
+        rows = data.loc[data['sub'] == sub]
+        for copy in range(count):
+            parts.append(rows.assign(cluster="%s_%d" % (sub, copy)))
+    return pd.concat(parts, ignore_index=True)
+
+
+def fitFold(task):
+    '''
+    Fits one model on one fold; returns its rows of the tidy table
+    '''
+    name, scheme, fold, train, test = task
+    formula, family, rows = MODELS[name]
+    data = modelRows(_data, rows)
+    trainData = trainingRows(data, train)
+    testData = data.loc[data['sub'].isin(test)]
+    if 'ratingAboveAvg' in formula:
+        # Threshold from the training rows only, so test ratings never shape the labels
+        threshold = trainData['rating'].mean()
+        trainData = addRatingLabel(trainData, threshold)
+        testData = addRatingLabel(testData, threshold)
+    trainData = trainData.dropna(subset=patsyColumns(formula, trainData))
+    testData = testData.dropna(subset=patsyColumns(formula, trainData))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if family == 'gaussian':
+            fit = smf.mixedlm(formula, trainData, groups=trainData['cluster']).fit(reml=True)
+            names = fit.model.exog_names
+            estimates, errors = fit.fe_params.values, fit.bse_fe.values
+        else:
+            model = BinomialBayesMixedGLM.from_formula(formula, {'sub': "0 + C(cluster)"}, trainData)
+            fit = model.fit_vb()
+            k = model.k_fep
+            names = model.exog_names[:k]
+            estimates, errors = fit.fe_mean, fit.fe_sd
+
+    out = [('coef', term, est, err) for term, est, err in zip(names, estimates, errors)]
+    out.append(('metric', 'n_train', len(trainData), np.nan))
+    out.append(('metric', 'n_test', len(testData), np.nan))
+
+    if len(testData) > 0:
+        response, predictors = formula.split("~")
+        designInfo = patsy.dmatrix(predictors, trainData.head(1)).design_info  ## Categories come from the dtypes
+        X = np.asarray(patsy.build_design_matrices([designInfo], testData)[0])
+        eta = X.dot(estimates)
+        y = testData[response.strip()].values.astype(float)
+        if family == 'gaussian':
+            out.append(('metric', 'rmse', np.sqrt(np.mean((eta - y) ** 2)), np.nan))
+            out.append(('metric', 'mae', np.mean(np.abs(eta - y)), np.nan))
+        else:
+            p = np.clip(1 / (1 + np.exp(-eta)), 1e-12, 1 - 1e-12)
+            out.append(('metric', 'accuracy', np.mean((p >= 0.5) == y), np.nan))
+            out.append(('metric', 'log_loss', -np.mean(y * np.log(p) + (1 - y) * np.log(1 - p)), np.nan))
+
+    return pd.DataFrame([(name, scheme, fold) + row for row in out],
+                        columns=['model', 'scheme', 'fold', 'kind', 'term', 'estimate', 'std_err'])
+
+
+def patsyColumns(formula, data):
+    '''
+    Data columns a formula uses (to drop incomplete rows first, as lmer does)
+    '''
+    desc = patsy.ModelDesc.from_formula(formula)
+    used = set(factor.code for term in desc.lhs_termlist + desc.rhs_termlist for factor in term.factors)
+    return [c for c in data.columns if c in used]
+
+
+def runHarness(data, models=None, n_folds=6, n_boots=200, seed=0, n_workers=None):
+    '''
+    Fits every model on every fold across a pool of processes;
+    returns the tidy table of all folds
+    '''
+    models = models or list(MODELS)
+    folds = makeFolds(data['sub'].cat.categories, n_folds, n_boots, seed)
+    tasks = [(name,) + fold for name in models for fold in folds]
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context,
+                             initializer=_shareData, initargs=(data,)) as pool:
+        results = list(pool.map(fitFold, tasks, chunksize=4))
+    return pd.concat(results, ignore_index=True)
+
+
+def summarize(results):
+    '''
+    Mean, SD and 2.5/97.5 percentiles of each term over folds, by model and scheme
+    '''
+    grouped = results.groupby(['model', 'scheme', 'kind', 'term'], sort=False)['estimate']
+    return grouped.agg(mean='mean', sd='std',
+                       lower=lambda x: x.quantile(0.025),
+                       upper=lambda x: x.quantile(0.975),
+                       n_folds='count').reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validate and bootstrap the Report.Rmd models")
+    parser.add_argument('--data', default="neurofit_data.csv")
+    parser.add_argument('--models', nargs='*', choices=list(MODELS), default=None)
+    parser.add_argument('--folds', type=int, default=6, help="leave-subjects-out folds")
+    parser.add_argument('--boots', type=int, default=200, help="cluster bootstrap resamples")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', help="write the per-fold table to this CSV file")
+    args = parser.parse_args()
+
+    results = runHarness(loadModelData(args.data), args.models, args.folds, args.boots, args.seed, args.workers)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(summarize(results).to_string(index=False, float_format=lambda x: '%.4f' % x))
+    if args.out:
+        results.to_csv(args.out, index=False)
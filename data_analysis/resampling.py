@@ -0,0 +1,152 @@
+'''
+Permutation tests and cluster-bootstrap intervals for the message type
+effects (valence x s_ns) on steps and ratings, as a check on the model
+p-values in Report.Rmd.
+
+On message days, each outcome is centered within subject, then
+summarized by the four cell means (positive/negative x social/
+nonsocial) and three contrasts of them:
+    valence      -- positive - negative (averaged over s_ns)
+    social       -- social - nonsocial (averaged over valence)
+    interaction  -- (pos. social - pos. nonsocial) - (neg. social - neg. nonsocial)
+
+Permutations shuffle the message labels within each subject; the
+bootstrap resamples subjects with replacement. Each batch of resamples
+is one set of array operations over a (resamples x days) matrix, and
+batches can be spread over processes.
+
+Usage (from this directory):
+    python resampling.py --n 10000 --workers 4 --out resampling.csv
+'''
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from loadData import loadModelData
+
+
+CELLS = ['positive_social', 'positive_nonsocial', 'negative_social', 'negative_nonsocial']
+EFFECTS = ['valence', 'social', 'interaction']
+OUTCOMES = ['TotalSteps', 'rating']
+BATCH = 1000  ## Resamples per batch
+
+
+def messageDays(data, outcome):
+    '''
+    Message days with the outcome, sorted by subject; returns (subject
+    codes 0..S-1, cell codes 0..3 (as CELLS), within-subject centered outcome)
+    '''
+    days = data.loc[data['type'].isin(CELLS)].dropna(subset=[outcome])
+    days = days.sort_values('sub', kind='mergesort')
+    subjects = days['sub'].cat.remove_unused_categories().cat.codes.values
+    cells = pd.Categorical(days['type'].astype(str), categories=CELLS).codes
+    y = days[outcome].values.astype(float)
+    y = y - days.groupby('sub', observed=True)[outcome].transform('mean').values
+    return subjects, cells, y
+
+
+def contrasts(sums, counts):
+    '''
+    Effects (..., 3) from per-cell sums and counts (..., 4)
+    '''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    ps, pn, ns, nn = [means[..., i] for i in range(4)]
+    return np.stack([(ps + pn) / 2 - (ns + nn) / 2,
+                     (ps + ns) / 2 - (pn + nn) / 2,
+                     (ps - pn) - (ns - nn)], axis=-1)
+
+
+def weightedEffects(cells, y, weights):
+    '''
+    Effects for each row of weights (resamples x days)
+    '''
+    sums = np.stack([(weights * (y * (cells == c))).sum(axis=1) for c in range(len(CELLS))], axis=1)
+    counts = np.stack([(weights * (cells == c)).sum(axis=1) for c in range(len(CELLS))], axis=1)
+    return contrasts(sums, counts)
+
+
+def permutedEffects(subjects, cells, y, n, seed):
+    '''
+    Effects for n within-subject permutations of the cell labels.
+    Days are sorted by subject, so sorting (subject + uniform noise)
+    along each row shuffles within subjects only
+    '''
+    rng = np.random.default_rng(seed)
+    order = np.argsort(subjects + rng.random((n, len(subjects))), axis=1)
+    permuted = cells[order]
+    sums = np.stack([((permuted == c) * y).sum(axis=1) for c in range(len(CELLS))], axis=1)
+    counts = np.stack([(permuted == c).sum(axis=1) for c in range(len(CELLS))], axis=1)
+    return contrasts(sums, counts)
+
+
+def bootstrapEffects(subjects, cells, y, n, seed):
+    '''
+    Effects for n cluster-bootstrap resamples: each day is weighted
+    by how many times its subject was drawn
+    '''
+    rng = np.random.default_rng(seed)
+    nSubjects = subjects.max() + 1
+    draws = rng.multinomial(nSubjects, np.full(nSubjects, 1.0 / nSubjects), size=n)
+    return weightedEffects(cells, y, draws[:, subjects])
+
+
+def _runBatch(args):
+    method, subjects, cells, y, n, seed = args
+    if method == 'permutation':
+        return permutedEffects(subjects, cells, y, n, seed)
+    return bootstrapEffects(subjects, cells, y, n, seed)
+
+
+def resample(subjects, cells, y, method, n=10000, seed=0, n_workers=1, batch=BATCH):
+    '''
+    (n x 3) effects from n resamples, in batches of up to `batch`,
+    over n_workers processes (in this process if 1)
+    '''
+    sizes = [batch] * (n // batch) + ([n % batch] if n % batch else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(method, subjects, cells, y, size, s) for size, s in zip(sizes, seeds)]
+    if n_workers == 1:
+        return np.concatenate([_runBatch(t) for t in tasks])
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        return np.concatenate(list(pool.map(_runBatch, tasks)))
+
+
+def messageTypeEffects(data, outcomes=OUTCOMES, n=10000, seed=0, n_workers=1):
+    '''
+    One row per outcome and effect: the observed effect, its two-sided
+    permutation p-value, and the bootstrap SE and 95% percentile interval
+    '''
+    rows = []
+    for outcome in outcomes:
+        subjects, cells, y = messageDays(data, outcome)
+        observed = weightedEffects(cells, y, np.ones((1, len(y))))[0]
+        permuted = resample(subjects, cells, y, 'permutation', n, seed, n_workers)
+        boot = resample(subjects, cells, y, 'bootstrap', n, seed + 1, n_workers)
+        extreme = (np.abs(permuted) >= np.abs(observed) - 1e-12).sum(axis=0)
+        for i, effect in enumerate(EFFECTS):
+            rows.append({'outcome': outcome, 'effect': effect, 'estimate': observed[i],
+                         'p_permutation': (extreme[i] + 1) / (n + 1),
+                         'boot_se': np.nanstd(boot[:, i], ddof=1),
+                         'boot_lower': np.nanpercentile(boot[:, i], 2.5),
+                         'boot_upper': np.nanpercentile(boot[:, i], 97.5),
+                         'n_days': len(y), 'n_subjects': subjects.max() + 1})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Permutation and cluster-bootstrap tests of message type effects")
+    parser.add_argument('--data', default="neurofit_data.csv")
+    parser.add_argument('--n', type=int, default=10000, help="resamples of each kind")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--out', help="also write the table to this CSV file")
+    args = parser.parse_args()
+
+    table = messageTypeEffects(loadModelData(args.data), n=args.n, seed=args.seed, n_workers=args.workers)
+    print(table.to_string(index=False, float_format=lambda x: '%.4f' % x))
+    if args.out:
+        table.to_csv(args.out, index=False)
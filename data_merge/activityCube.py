@@ -0,0 +1,92 @@
+'''
+Dense subject x study-day x metric array of the daily Fitabase
+measures, written next to the merged CSV so analyses can slice
+it (memory-mapped) instead of regrouping the long file.
+
+Files, in the output directory (data_clean/activity_cube by default):
+    cube.npy      -- float32 array (subjects, days, metrics), NaN where
+                     a subject has no data for a day
+    subjects.csv  -- one row per subject, in cube order: sub, start_date
+                     (the date of day 0), n_days, msg_start_offset
+                     (day index of the first messaging day, or -1)
+    metrics.csv   -- metric names, in cube order
+
+Day d of subject i is start_date + d days; cube[i, offset:] starts at
+the subject's first messaging day (offset = msg_start_offset).
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+METRICS = ['TotalSteps', 'VeryActiveMinutes', 'FairlyActiveMinutes', 'LightlyActiveMinutes',
+           'SedentaryMinutes', 'TotalMinutesAsleep', 'RestingHeartRate']
+CUBE_DIR = os.path.join("data_clean", "activity_cube")
+
+
+def writeCube(merged, out_dir=CUBE_DIR, metrics=METRICS):
+    '''
+    Takes the combined merged dataframe (one or more rows per subject
+    and ActivityDate, with "NA" for missing values) and writes the cube
+    and its index files to out_dir
+    '''
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    days = merged.drop_duplicates(subset=['sub', 'ActivityDate'])
+    dates = pd.to_datetime(days['ActivityDate'])
+    subs = np.sort(days['sub'].unique())
+    subIndex = np.searchsorted(subs, days['sub'].values)
+
+    start = dates.groupby(subIndex).min()
+    dayIndex = ((dates.values - start.values[subIndex]) // np.timedelta64(1, 'D')).astype(int)
+    nDays = pd.Series(dayIndex).groupby(subIndex).max().values + 1
+
+    msgDays = pd.Series(np.where(pd.to_numeric(days['msg_start'], errors='coerce') == 1, dayIndex, np.iinfo(int).max))
+    firstMsg = msgDays.groupby(subIndex).min().values
+    offsets = np.where(firstMsg == np.iinfo(int).max, -1, firstMsg)
+
+    cube = np.lib.format.open_memmap(os.path.join(out_dir, "cube.npy"), mode='w+', dtype=np.float32,
+                                     shape=(len(subs), int(nDays.max()), len(metrics)))
+    cube[:] = np.nan
+    values = days.reindex(columns=metrics).apply(pd.to_numeric, errors='coerce').values
+    cube[subIndex, dayIndex, :] = values
+    cube.flush()
+    del cube
+
+    pd.DataFrame({'sub': subs, 'start_date': start.dt.strftime("%Y-%m-%d").values,
+                  'n_days': nDays, 'msg_start_offset': offsets}) \
+        .to_csv(os.path.join(out_dir, "subjects.csv"), index=False)
+    pd.DataFrame({'metric': metrics}).to_csv(os.path.join(out_dir, "metrics.csv"), index=False)
+
+
+def loadCube(cube_dir=CUBE_DIR, mode='r'):
+    '''
+    Returns (cube, subjects, metrics): the memory-mapped array, the
+    subjects.csv dataframe and the list of metric names
+    '''
+    cube = np.load(os.path.join(cube_dir, "cube.npy"), mmap_mode=mode)
+    subjects = pd.read_csv(os.path.join(cube_dir, "subjects.csv"))
+    metrics = pd.read_csv(os.path.join(cube_dir, "metrics.csv"))['metric'].tolist()
+    return cube, subjects, metrics
+
+
+def alignToMessages(cube, subjects, before=0, after=None):
+    '''
+    Copies the cube into an array (subjects, before + after, metrics)
+    whose day `before` is each subject's first messaging day, NaN-padded
+    (a copy, since offsets differ; cube[i, offset:] is a view for one
+    subject); subjects with no messaging days are all NaN
+    '''
+    if after is None:
+        after = cube.shape[1]
+    aligned = np.full((cube.shape[0], before + after, cube.shape[2]), np.nan, dtype=cube.dtype)
+    for i, offset in enumerate(subjects['msg_start_offset'].values):
+        if offset < 0:
+            continue
+        lo = max(offset - before, 0)
+        hi = min(offset + after, cube.shape[1])
+        aligned[i, lo - offset + before:hi - offset + before] = cube[i, lo:hi]
+    return aligned
@@ -0,0 +1,75 @@
+'''
+Aligns timestamped rows (SMS, daily surveys) to the participant's
+activity days, collapsing them to at most one row per day first so
+that later merges (including the fMRI join) cannot multiply rows.
+
+Each row is assigned to the calendar day of its timestamp; rows on
+the same day are either reduced to the day's earliest row, whole
+(default 'row', so values from different rows are never mixed), or
+combined column by column with an explicit rule:
+    'first' -- the earliest non-blank value
+    'last'  -- the latest non-blank value
+    'mean'  -- the mean of the numeric values (blanks ignored)
+Rows whose timestamp is missing or invalid are dropped, as before.
+'''
+
+import pandas as pd
+
+
+## The day's first SMS is the one that counts (it starts the subject day);
+## it is kept whole, so its valence, s_ns, id and message always match
+SMS_RULES = {}
+
+## Survey item scores are averaged over a day's entries;
+## timestamp and location come from the last (most recent) entry
+SURVEY_RULES = {'daily_survey_timestamp': 'last', 'location': 'last',
+                'lap': 'mean', 'hap': 'mean', 'han': 'mean', 'lan': 'mean',
+                'la': 'mean', 'p': 'mean', 'n': 'mean', 'ha': 'mean',
+                'self_efficacy_daily': 'mean'}
+
+
+def collapseToDays(rows, time_col, date_col, rules=None, default='row'):
+    '''
+    Takes rows with a timestamp column and returns (collapsed, duplicates):
+    collapsed has one row per day, with the day (YYYY-MM-DD) in date_col;
+    duplicates has one row per day that had more than one row,
+    with the number of rows combined ('n_rows'). Columns without a
+    rule come from the day's earliest row (or follow default)
+    '''
+    rules = rules or {}
+    times = pd.to_datetime(rows[time_col], errors='coerce')
+    rows = rows.loc[times.notna()].copy()
+    rows['_time'] = times[times.notna()]
+    rows = rows.sort_values('_time', kind='mergesort')  ## Stable, so ties keep file order
+    rows[date_col] = rows['_time'].dt.strftime("%Y-%m-%d")
+
+    aggs = {}
+    for col in rows.columns:
+        if col in ('_time', date_col):
+            continue
+        rule = rules.get(col, default)
+        if rule == 'mean':
+            rows[col] = pd.to_numeric(rows[col], errors='coerce')
+        aggs[col] = rule
+
+    byDay = rows.groupby(date_col, sort=True)
+    wholeRow = [col for col, rule in aggs.items() if rule == 'row']
+    collapsed = byDay.head(1).set_index(date_col)[wholeRow]  ## Rows are in time order
+    ruled = {col: rule for col, rule in aggs.items() if rule != 'row'}
+    if ruled:
+        collapsed = collapsed.join(byDay.agg(ruled))
+    collapsed = collapsed.sort_index()[list(aggs)].reset_index()
+    counts = byDay.size()
+    duplicates = counts[counts > 1].rename('n_rows').reset_index()
+    return collapsed, duplicates
+
+
+def reportDuplicates(uid, label, duplicates):
+    '''
+    Prints which days had several rows collapsed into one
+    '''
+    if duplicates.empty:
+        return
+    print("uid %s: %d %s rows collapsed into %d day(s): %s" %
+          (uid, duplicates['n_rows'].sum(), label, len(duplicates),
+           ", ".join(duplicates.iloc[:, 0].tolist())))
@@ -0,0 +1,139 @@
+'''
+Persistent per-subject store of the daily Fitabase exports (daily
+activity and sleep "day" logs), so a new export that overlaps the
+previous ones only adds or replaces the days that are new or changed.
+
+Exports are files in 'data_raw' starting with the participant id, with
+their date range at the end of the name (..._20170122_20200522.csv).
+They are ingested oldest range first, so a later export wins for days
+that differ. Each export is ingested once; the store records which
+export supplied each day.
+
+Store layout (data_clean/daily_store by default):
+    activity/<uid>.csv, sleep/<uid>.csv
+        -- the export's own columns, plus 'date' (YYYY-MM-DD, the key
+           with the subject), 'row_hash' and 'source' (export file name)
+    ingested.csv
+        -- exports already ingested, with the days they added and changed
+
+The per-subject files read like the exports themselves, so the merge
+can use them in their place (see mergeData(..., use_store=True)).
+'''
+
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+
+STORE_DIR = os.path.join("data_clean", "daily_store")
+KINDS = {'activity': ('Activity', 'ActivityDate'), 'sleep': ('sleep', 'SleepDay')}
+
+## Day columns are m/d/Y, sometimes followed by a (midnight) time
+DATE_FORMAT = "%m/%d/%Y"
+
+EXPORT_PATTERN = re.compile(r'^(?P<uid>\d{4}).*_(?P<start>\d{8})_(?P<end>\d{8})\.csv$')
+
+
+def findExports(listing):
+    '''
+    Exports in a directory listing, oldest date range first, as
+    a dataframe: file, uid, kind, start, end
+    '''
+    rows = []
+    for f in listing:
+        match = EXPORT_PATTERN.match(f)
+        if match is None:
+            continue
+        for kind, (marker, _) in KINDS.items():
+            if marker in f:
+                rows.append({'file': f, 'uid': match.group('uid'), 'kind': kind,
+                             'start': match.group('start'), 'end': match.group('end')})
+    exports = pd.DataFrame(rows, columns=['file', 'uid', 'kind', 'start', 'end'])
+    return exports.sort_values(['end', 'start', 'file'], kind='mergesort').reset_index(drop=True)
+
+
+def latestExport(files, label=None):
+    '''
+    The export with the latest date range in its name (files without
+    one count as oldest), or None; with a label (e.g. "minuteSteps"),
+    says which file is used when there are several
+    '''
+    if not files:
+        return None
+    dateRange = lambda f: EXPORT_PATTERN.match(f).group('end', 'start') if EXPORT_PATTERN.match(f) else ("", "")
+    latest = max(files, key=lambda f: (dateRange(f), f))
+    if label is not None and len(files) > 1:
+        print(str(len(files)) + " " + label + " files found. Using file: " + latest + "\n")
+    return latest
+
+
+def storeFile(store_dir, kind, uid):
+    return os.path.join(store_dir, kind, uid + ".csv")
+
+
+def hashRows(frame):
+    '''
+    Hash of each row's values (as read from the export, so formatting
+    changes count as changes)
+    '''
+    return pd.util.hash_pandas_object(frame.astype(str), index=False).values
+
+
+def upsertExport(path_to_data, export, store_dir):
+    '''
+    Adds one export's new and changed days to its subject's store file;
+    returns (days added, days changed)
+    '''
+    dateCol = KINDS[export['kind']][1]
+    rows = pd.read_csv(path_to_data + export['file'], dtype=str)
+    rows['date'] = pd.to_datetime(rows[dateCol].str.split(" ").str[0], format=DATE_FORMAT,
+                                  errors='coerce').dt.strftime("%Y-%m-%d")
+    rows = rows.dropna(subset=['date']).drop_duplicates(subset=['date'], keep='last')
+    rows['row_hash'] = hashRows(rows.drop(columns=['date']))
+    rows['source'] = export['file']
+
+    fname = storeFile(store_dir, export['kind'], export['uid'])
+    if os.path.exists(fname):
+        stored = pd.read_csv(fname, dtype=str)
+        known = stored.set_index('date')['row_hash']
+        previous = rows['date'].map(known)
+        isNew = previous.isna()
+        isChanged = ~isNew & (previous != rows['row_hash'].astype(str))
+        upserts = rows.loc[isNew | isChanged]
+        if upserts.empty:
+            return 0, 0
+        stored = pd.concat([stored.loc[~stored['date'].isin(upserts['date'])], upserts], sort=False)
+    else:
+        isNew, isChanged = np.ones(len(rows), dtype=bool), np.zeros(len(rows), dtype=bool)
+        stored = rows
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+
+    stored.sort_values('date').to_csv(fname, index=False)
+    return int(isNew.sum()), int(isChanged.sum())
+
+
+def ingestExports(path_to_data, listing, store_dir=STORE_DIR):
+    '''
+    Upserts every export not ingested yet; returns the
+    rows of ingested.csv added by this call
+    '''
+    logFile = os.path.join(store_dir, "ingested.csv")
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    done = set(pd.read_csv(logFile)['file']) if os.path.exists(logFile) else set()
+
+    exports = findExports(listing)
+    exports = exports.loc[~exports['file'].isin(done)]
+    log = []
+    for _, export in exports.iterrows():
+        added, changed = upsertExport(path_to_data, export, store_dir)
+        log.append({'file': export['file'], 'uid': export['uid'], 'kind': export['kind'],
+                    'days_added': added, 'days_changed': changed})
+
+    log = pd.DataFrame(log, columns=['file', 'uid', 'kind', 'days_added', 'days_changed'])
+    if len(log):
+        log.to_csv(logFile, mode='a', header=not os.path.exists(logFile), index=False)
+    return log
@@ -0,0 +1,63 @@
+'''
+Participant demographics from the REDCap visit export, kept as one
+row per subject and attached to the combined output at the end.
+
+Put the export in 'data_raw' with a name starting with "Demographics"
+(the newest, by file name, is used). Either REDCap export format works:
+labels ("Record ID", "Event Name", ...) or raw (record_id,
+redcap_event_name, ...). Subject numbers are 1000 + Record ID.
+Each subject's age and gender come from their first event (visit)
+that has them.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+SUBJECT_OFFSET = 1000
+COLUMNS = ['Record ID', 'Event Name', 'age', 'gender']
+RAW_NAMES = {'record_id': 'Record ID', 'redcap_event_name': 'Event Name'}
+
+
+def loadDemographics(path_to_data, listing):
+    '''
+    Returns the demographics table (indexed by integer sub, with
+    COLUMNS; gender is categorical), or None if there is no export
+    '''
+    exports = sorted(f for f in listing if f.startswith("Demographics"))
+    if not exports:
+        return None
+
+    visits = pd.read_csv(path_to_data + exports[-1]).rename(columns=RAW_NAMES)
+    visits = visits.dropna(subset=['Record ID'])
+    visits['sub'] = visits['Record ID'].astype(int) + SUBJECT_OFFSET
+
+    # Each subject's first event (in file order) with any demographics filled in
+    # (the whole row, so Event Name, age and gender all come from that visit)
+    visits = visits.dropna(subset=['age', 'gender'], how='all')
+    demographics = visits.groupby('sub', sort=True).head(1).set_index('sub').sort_index()[COLUMNS]
+    demographics['Record ID'] = demographics['Record ID'].astype(int)
+    demographics['age'] = demographics['age'].astype('Int64')  ## Whole years, written without ".0"
+    demographics['gender'] = demographics['gender'].astype('category')
+    return demographics
+
+
+def attachDemographics(merged, demographics):
+    '''
+    Adds the demographic columns to the merged rows: each row's subject
+    is looked up once as a position in the (small) subject table, and
+    the columns are taken from it by position ("NA" for subjects
+    missing from the export); gender stays categorical
+    '''
+    position = pd.Categorical(merged['sub'].astype(int), categories=demographics.index).codes
+    merged = merged.copy()
+    for col in COLUMNS:
+        column = demographics[col]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            column = column.cat.add_categories(["NA"]).fillna("NA")
+            codes = np.append(column.cat.codes.values, column.cat.categories.get_loc("NA"))
+            merged[col] = pd.Categorical.from_codes(codes[position], column.cat.categories)
+        else:
+            values = column.astype(object).where(column.notna(), "NA").values
+            merged[col] = np.append(values, "NA")[position]  ## Position -1 is "NA"
+    return merged
@@ -0,0 +1,174 @@
+'''
+Builds HRF-convolved first-level design matrices from the fMRI
+events files (sub-XXXX_task-HealthMessage_run-XX_events.tsv)
+in 'data_raw', for every subject and run.
+
+Columns of each design matrix (one row per scan):
+    message_pos_soc, message_pos_nonsoc,
+    message_neg_soc, message_neg_nonsoc  -- 8 s messages, by condition
+    message_x_rating                     -- (optional) messages modulated
+                                            by the mean-centered rating
+    rating                               -- rating screen
+    constant
+
+Results are cached in 'data_clean/design_matrices' as one CSV per
+subject and run, keyed by the events file contents and the settings,
+so re-running only rebuilds matrices whose inputs changed.
+
+Run from this directory, e.g.:
+    python designMatrices.py --tr 2 --scans 350 --modulate
+'''
+
+import argparse
+import hashlib
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+path_to_data = os.path.join("data_raw", "")
+path_to_cache = os.path.join("data_clean", "design_matrices")
+
+CONDITIONS = ['pos_soc', 'pos_nonsoc', 'neg_soc', 'neg_nonsoc']
+
+
+def canonicalHRF(dt, length=32.0):
+    '''
+    Double-gamma HRF with SPM's default shape (response
+    peaking ~5 s, undershoot ~15 s at 1/6 amplitude),
+    sampled every dt seconds and scaled to unit area
+    '''
+    t = np.arange(0, length, dt)
+    logt = np.log(np.maximum(t, 1e-12))
+    peak = np.exp(5 * logt - t - math.lgamma(6))
+    undershoot = np.exp(15 * logt - t - math.lgamma(16))
+    hrf = peak - undershoot / 6.0
+    return hrf / (hrf.sum() * dt)
+
+
+def loadEvents(uids=None):
+    '''
+    Reads all subjects' fMRI events files into one dataframe
+    with 'sub' and 'run' columns; only the given uids, if any
+    '''
+    frames = []
+    for f in sorted(os.listdir(path_to_data)):
+        if not (f.startswith("sub-") and "_task-HealthMessage_run-" in f and f.endswith("_events.tsv")):
+            continue
+        uid = f[4:8]
+        if uids is not None and uid not in uids:
+            continue
+        events = pd.read_csv(path_to_data + f, sep='\t')
+        events['sub'] = uid
+        events['run'] = f.split("_run-")[1][:2]
+        frames.append(events)
+    return pd.concat(frames, ignore_index=True)
+
+
+def eventsHash(events, tr, n_scans, modulate, oversampling):
+    '''
+    Cache key for one run: changes if the events or settings change
+    '''
+    h = hashlib.md5(pd.util.hash_pandas_object(events, index=False).values.tobytes())
+    h.update(("%s_%s_%s_%s" % (tr, n_scans, modulate, oversampling)).encode())
+    return h.hexdigest()[:12]
+
+
+def buildDesignMatrix(events, tr, n_scans, modulate=False, oversampling=16):
+    '''
+    Design matrix (n_scans rows) for one run's events: boxcars on a
+    grid oversampling times finer than the TR, all convolved with the
+    HRF at once by FFT, then sampled at the start of each scan
+    '''
+    dt = tr / oversampling
+    n_fine = n_scans * oversampling
+
+    messages = events.loc[events['trial_type'] == 'message']
+    ratings = events.loc[events['trial_type'] == 'rating']
+
+    columns = ["message_" + c for c in CONDITIONS]
+    condition = (messages['valence'].str[:3] + "_" + messages['s_ns'].str[:-3]).values
+    onsetSets = [messages.loc[condition == c] for c in CONDITIONS]
+    amplitudes = [np.ones(len(m)) for m in onsetSets]
+
+    if modulate:
+        columns.append("message_x_rating")
+        onsetSets.append(messages)
+        rating = pd.to_numeric(messages['rating'], errors='coerce')
+        amplitudes.append((rating - rating.mean()).fillna(0).values)
+
+    columns.append("rating")
+    onsetSets.append(ratings)
+    amplitudes.append(np.ones(len(ratings)))
+
+    # Boxcars: +amplitude at each onset, -amplitude at each offset, then cumulative sum
+    steps = np.zeros((n_fine + 1, len(columns)))
+    for col, (evts, amp) in enumerate(zip(onsetSets, amplitudes)):
+        on = np.clip(np.round(evts['onset'].values / dt).astype(int), 0, n_fine)
+        off = np.clip(np.round((evts['onset'].values + evts['duration'].values) / dt).astype(int), 0, n_fine)
+        np.add.at(steps[:, col], on, amp)
+        np.add.at(steps[:, col], off, -amp)
+    boxcars = np.cumsum(steps[:n_fine], axis=0)
+
+    hrf = canonicalHRF(dt)
+    n_fft = 1 << int(np.ceil(np.log2(n_fine + len(hrf))))
+    convolved = np.fft.irfft(np.fft.rfft(boxcars, n_fft, axis=0) * np.fft.rfft(hrf, n_fft)[:, None],
+                             n_fft, axis=0)[:n_fine] * dt
+
+    design = pd.DataFrame(convolved[::oversampling], columns=columns)
+    design['constant'] = 1.0
+    design.index.name = 'scan'
+    return design
+
+
+def designMatricesForUser(args):
+    '''
+    Builds (or loads from the cache) the design matrix for each of
+    one subject's runs; returns {(uid, run): dataframe}
+    '''
+    uid, userEvents, tr, n_scans, modulate, oversampling = args
+    results = {}
+    for run, runEvents in userEvents.groupby('run'):
+        runEvents = runEvents.sort_values('onset').reset_index(drop=True)
+        key = eventsHash(runEvents, tr, n_scans, modulate, oversampling)
+        fname = os.path.join(path_to_cache, "sub-%s_run-%s_design_%s.csv" % (uid, run, key))
+        if os.path.exists(fname):
+            design = pd.read_csv(fname, index_col='scan')
+        else:
+            design = buildDesignMatrix(runEvents, tr, n_scans, modulate, oversampling)
+            design.to_csv(fname)
+        results[(uid, run)] = design
+    return results
+
+
+def buildAllDesignMatrices(uids=None, tr=2.0, n_scans=350, modulate=False, oversampling=16, n_workers=None):
+    '''
+    Design matrices for every subject and run, built across
+    a pool of processes (one task per subject)
+    '''
+    if not os.path.isdir(path_to_cache):
+        os.makedirs(path_to_cache)
+
+    events = loadEvents(uids)
+    tasks = [(uid, userEvents, tr, n_scans, modulate, oversampling) for uid, userEvents in events.groupby('sub')]
+
+    designs = {}
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        for result in pool.map(designMatricesForUser, tasks):
+            designs.update(result)
+    return designs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build HRF-convolved design matrices for all events files")
+    parser.add_argument('--tr', type=float, default=2.0, help="repetition time (sec)")
+    parser.add_argument('--scans', type=int, default=350, help="number of scans per run")
+    parser.add_argument('--modulate', action='store_true', help="add the rating as a parametric modulator")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    designs = buildAllDesignMatrices(tr=args.tr, n_scans=args.scans, modulate=args.modulate, n_workers=args.workers)
+    print("Design matrices for %d runs in %s" % (len(designs), path_to_cache))
@@ -0,0 +1,125 @@
+'''
+Daily heart-rate features from Fitabase second-level heart-rate
+exports ("heartrate_seconds": Time, Value), computed by streaming
+each file in chunks so memory use does not depend on file size.
+
+Features, one row per ActivityDate:
+    wear_minutes          -- minutes with at least one HR sample
+    hr_<zone>_minutes     -- minutes whose mean HR falls in each zone
+                             (out_of_range, fat_burn, cardio, peak;
+                             bounds in bpm are ZONE_BOUNDS)
+    hr_pre_sms            -- mean HR in the SMS_WINDOW minutes before
+    hr_post_sms              and after that day's SMS,
+    hr_sms_response          and their difference (post - pre)
+If a subject has several exports, the one with the latest date range
+in its name is used.
+'''
+
+import numpy as np
+import pandas as pd
+
+from dailyStore import latestExport
+
+
+## Lower bounds (bpm) of the fat burn, cardio and peak zones; Fitbit's
+## defaults (50/70/85% of 220 - age) for a 50-year-old
+ZONE_BOUNDS = (85, 119, 145)
+ZONE_NAMES = ('out_of_range', 'fat_burn', 'cardio', 'peak')
+SMS_WINDOW = 60  ## minutes
+CHUNK_ROWS = 2000000
+
+TIME_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+
+
+def heartrateColumns():
+    '''
+    Names of all the columns heartrateFeatures() can produce
+    '''
+    return (['wear_minutes'] + ["hr_%s_minutes" % z for z in ZONE_NAMES] +
+            ['hr_pre_sms', 'hr_post_sms', 'hr_sms_response'])
+
+
+def readMinuteMeans(fname, chunk_rows=CHUNK_ROWS):
+    '''
+    Yields (minute timestamps, mean HR) for each chunk of a heart-rate
+    file. The file is in time order, so samples from a chunk's last
+    minute are held back and joined to the next chunk, keeping every
+    minute whole
+    '''
+    carry = None
+    reader = pd.read_csv(fname, usecols=['Time', 'Value'], dtype={'Value': np.float32}, chunksize=chunk_rows)
+    for chunk in reader:
+        times = pd.to_datetime(chunk['Time'], format=TIME_FORMAT, errors='coerce')
+        samples = pd.DataFrame({'minute': times.dt.floor('min'), 'hr': chunk['Value']}).dropna()
+        if carry is not None:
+            samples = pd.concat([carry, samples])
+        if samples.empty:
+            continue
+        last = samples['minute'].values[-1]
+        carry = samples[samples['minute'] == last]
+        samples = samples[samples['minute'] != last]
+        if not samples.empty:
+            means = samples.groupby('minute')['hr'].mean()
+            yield means.index.values, means.values
+
+    if carry is not None and not carry.empty:
+        means = carry.groupby('minute')['hr'].mean()
+        yield means.index.values, means.values
+
+
+def heartrateFeatures(fitabase_files, path_to_data, smsTimes=None, chunk_rows=CHUNK_ROWS):
+    '''
+    Takes one participant's Fitabase file names and (optionally) the
+    datetimes of their SMS, and returns a dataframe of daily heart-rate
+    features indexed by ActivityDate (YYYY-MM-DD), or None if there is
+    no heart-rate file
+    '''
+    hrFile = latestExport([f for f in fitabase_files if "heartrate_seconds" in f], "heartrate_seconds")
+    if hrFile is None:
+        return None
+
+    if smsTimes is not None:
+        smsTimes = np.sort(np.asarray(smsTimes, dtype='datetime64[ns]'))
+    window = np.timedelta64(SMS_WINDOW, 'm')
+
+    daily = None
+    smsSums = None
+    for minutes, hr in readMinuteMeans(path_to_data + hrFile, chunk_rows):
+        days = minutes.astype('datetime64[D]')
+        zone = np.searchsorted(np.asarray(ZONE_BOUNDS), hr, side='right')
+        chunk = pd.DataFrame({'date': days, 'wear_minutes': 1})
+        for z, name in enumerate(ZONE_NAMES):
+            chunk["hr_%s_minutes" % name] = (zone == z).astype(int)
+        chunkSums = chunk.groupby('date').sum()
+        daily = chunkSums if daily is None else daily.add(chunkSums, fill_value=0)
+
+        if smsTimes is not None and len(smsTimes) > 0:
+            # Minutes after the latest SMS (post), and before the next one (pre)
+            latest = np.searchsorted(smsTimes, minutes, side='right') - 1
+            upcoming = latest + 1
+            post = (latest >= 0) & (minutes - smsTimes[np.maximum(latest, 0)] < window)
+            pre = (upcoming < len(smsTimes)) & \
+                  (smsTimes[np.minimum(upcoming, len(smsTimes) - 1)] - minutes <= window)
+            frames = []
+            for mask, smsIndex, label in [(post, latest, 'post'), (pre, upcoming, 'pre')]:
+                if mask.any():
+                    frames.append(pd.DataFrame({'date': smsTimes[smsIndex[mask]].astype('datetime64[D]'),
+                                                label + '_sum': hr[mask], label + '_n': 1}))
+            if frames:
+                chunkSums = pd.concat(frames, sort=False).fillna(0).groupby('date').sum()
+                smsSums = chunkSums if smsSums is None else smsSums.add(chunkSums, fill_value=0)
+
+    if daily is None:
+        return None
+    daily = daily.astype(int)  ## Minute counts
+
+    if smsSums is not None:
+        for label in ['pre', 'post']:
+            if label + '_sum' in smsSums:
+                daily['hr_%s_sms' % label] = smsSums[label + '_sum'] / smsSums[label + '_n'].replace(0, np.nan)
+        if 'hr_pre_sms' in daily and 'hr_post_sms' in daily:
+            daily['hr_sms_response'] = daily['hr_post_sms'] - daily['hr_pre_sms']
+
+    daily.index = pd.DatetimeIndex(daily.index).strftime("%Y-%m-%d")
+    daily.index.name = 'ActivityDate'
+    return daily
@@ -0,0 +1,136 @@
+'''
+Daily features from Fitabase minute-level exports, computed in
+bounded memory by reading each file in chunks.
+
+Files (in 'data_raw', starting with the participant id as usual):
+    1. Minute steps ("minuteStepsNarrow"): ActivityMinute, Steps
+    2. Minute intensities ("minuteIntensitiesNarrow"): ActivityMinute, Intensity
+If there are several exports of a kind, the one with the latest date
+range in its name is used.
+
+Features, one row per ActivityDate:
+    steps_post_sms_<H>h  -- steps in the H hours after that day's SMS
+                            (for each H in POST_SMS_HOURS)
+    steps_<HH>           -- steps per PROFILE_MINUTES window of the day,
+    intensity_<HH>          and mean intensity (0-3) in that window;
+                            named by the window's start hour (and minute)
+'''
+
+import numpy as np
+import pandas as pd
+
+from dailyStore import latestExport
+
+
+POST_SMS_HOURS = (1, 2, 4)
+PROFILE_MINUTES = 60
+CHUNK_ROWS = 1000000
+
+MINUTE_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+
+
+def windowNames(profile_minutes=PROFILE_MINUTES):
+    '''
+    Suffix for each window of the day, e.g. '07' (hourly) or '0730'
+    '''
+    starts = range(0, 24 * 60, profile_minutes)
+    if profile_minutes % 60 == 0:
+        return ["%02d" % (m // 60) for m in starts]
+    return ["%02d%02d" % (m // 60, m % 60) for m in starts]
+
+
+def intradayColumns(post_sms_hours=POST_SMS_HOURS, profile_minutes=PROFILE_MINUTES):
+    '''
+    Names of all the columns intradayFeatures() can produce
+    '''
+    windows = windowNames(profile_minutes)
+    return (["steps_post_sms_%dh" % h for h in post_sms_hours] +
+            ["steps_" + w for w in windows] +
+            ["intensity_" + w for w in windows])
+
+
+def readMinuteChunks(fname, value_col, chunk_rows=CHUNK_ROWS):
+    '''
+    Yields (minute timestamps, values) for each chunk of a narrow minute file
+    '''
+    reader = pd.read_csv(fname, usecols=['ActivityMinute', value_col],
+                         dtype={value_col: np.float32}, chunksize=chunk_rows)
+    for chunk in reader:
+        minutes = pd.to_datetime(chunk['ActivityMinute'], format=MINUTE_FORMAT, errors='coerce')
+        valid = minutes.notna().values
+        yield minutes.values[valid], chunk[value_col].values[valid]
+
+
+def profileSums(fname, value_col, profile_minutes, chunk_rows=CHUNK_ROWS):
+    '''
+    Sum and count of values per (date, window of the day), accumulated over chunks
+    '''
+    sums = None
+    for minutes, values in readMinuteChunks(fname, value_col, chunk_rows):
+        days = minutes.astype('datetime64[D]')
+        window = ((minutes - days).astype('timedelta64[m]').astype(np.int64)) // profile_minutes
+        chunkSums = pd.DataFrame({'date': days, 'window': window, 'sum': values, 'n': 1}) \
+            .groupby(['date', 'window']).sum()
+        sums = chunkSums if sums is None else sums.add(chunkSums, fill_value=0)
+    return sums
+
+
+def postSmsSums(fname, smsTimes, post_sms_hours, chunk_rows=CHUNK_ROWS):
+    '''
+    Steps in each window after an SMS, per SMS date; each minute counts
+    toward the latest SMS sent at or before it (so windows can run past midnight)
+    '''
+    smsTimes = np.sort(np.asarray(smsTimes, dtype='datetime64[ns]'))
+    maxMinutes = max(post_sms_hours) * 60
+    sums = None
+    for minutes, values in readMinuteChunks(fname, 'Steps', chunk_rows):
+        latest = np.searchsorted(smsTimes, minutes, side='right') - 1
+        hasSms = latest >= 0
+        sent = smsTimes[np.maximum(latest, 0)]
+        since = (minutes - sent).astype('timedelta64[m]').astype(np.int64)
+        keep = hasSms & (since < maxMinutes)
+        if not keep.any():
+            continue
+        chunk = pd.DataFrame({'date': sent[keep].astype('datetime64[D]')})
+        for h in post_sms_hours:
+            chunk["steps_post_sms_%dh" % h] = np.where(since[keep] < h * 60, values[keep], 0)
+        chunkSums = chunk.groupby('date').sum()
+        sums = chunkSums if sums is None else sums.add(chunkSums, fill_value=0)
+    return sums
+
+
+def intradayFeatures(fitabase_files, path_to_data, smsTimes=None, post_sms_hours=POST_SMS_HOURS,
+                     profile_minutes=PROFILE_MINUTES, chunk_rows=CHUNK_ROWS):
+    '''
+    Takes one participant's Fitabase file names and (optionally) the
+    datetimes of their SMS, and returns a dataframe of daily features
+    indexed by ActivityDate (YYYY-MM-DD), or None if there are no
+    minute-level files
+    '''
+    stepsFile = latestExport([f for f in fitabase_files if "minuteSteps" in f], "minuteSteps")
+    intensityFile = latestExport([f for f in fitabase_files if "minuteIntensities" in f], "minuteIntensities")
+    windows = windowNames(profile_minutes)
+    features = []
+
+    if stepsFile is not None:
+        stepSums = profileSums(path_to_data + stepsFile, 'Steps', profile_minutes, chunk_rows)
+        if stepSums is not None:
+            features.append(stepSums['sum'].unstack('window').rename(columns=lambda w: "steps_" + windows[w]))
+        if smsTimes is not None and len(smsTimes) > 0:
+            smsSums = postSmsSums(path_to_data + stepsFile, smsTimes, post_sms_hours, chunk_rows)
+            if smsSums is not None:
+                features.append(smsSums)
+
+    if intensityFile is not None:
+        intensitySums = profileSums(path_to_data + intensityFile, 'Intensity', profile_minutes, chunk_rows)
+        if intensitySums is not None:
+            meanIntensity = intensitySums['sum'] / intensitySums['n']
+            features.append(meanIntensity.unstack('window').rename(columns=lambda w: "intensity_" + windows[w]))
+
+    if not features:
+        return None
+
+    daily = pd.concat(features, axis=1)
+    daily.index = pd.DatetimeIndex(daily.index).strftime("%Y-%m-%d")
+    daily.index.name = 'ActivityDate'
+    return daily
@@ -0,0 +1,111 @@
+'''
+Autocorrelation (ACF) and partial autocorrelation (PACF) of daily
+steps up to lag K, for every subject at once, from the activity cube
+(see activityCube.py); the numbers behind the per-subject acf/pacf
+plots in the Report.Rmd appendix and the choice of StepsLag1/2.
+
+Missing days are gaps: each lag's autocovariance sums only the pairs
+of days that are both observed, and is normalized as R's acf with
+na.pass does, dividing by (pairs + lag) -- the number of days observed
+when there are no gaps -- rather than by the pairs alone (statsmodels'
+"adjusted" estimator), so the values match the Report.Rmd plots. All
+subjects' series are transformed together with one batched FFT, and
+the PACF comes from the Durbin-Levinson recursion, vectorized over
+subjects.
+
+Outputs (in data_clean, or the given directory):
+    steps_acf.csv          -- one row per subject and lag: acf, pacf, n_pairs
+    steps_acf_summary.csv  -- per lag: mean/median acf and pacf over subjects,
+                              and the share of subjects whose pacf is outside
+                              +/- 1.96 / sqrt(days observed)
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from activityCube import loadCube, CUBE_DIR
+
+
+MAX_LAG = 14
+
+
+def batchedACF(series, max_lag=MAX_LAG):
+    '''
+    Takes an array (subjects, days) with NaN for missing days and
+    returns (acf, n_pairs), both (subjects, max_lag + 1)
+    '''
+    observed = ~np.isnan(series)
+    n = observed.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.nansum(series, axis=1, keepdims=True) / n
+    x = np.where(observed, series - means, 0.0)
+    mask = observed.astype(float)
+
+    n_fft = 1 << int(np.ceil(np.log2(2 * series.shape[1])))
+    lagged = lambda a: np.fft.irfft(np.abs(np.fft.rfft(a, n_fft, axis=1)) ** 2, n_fft, axis=1)[:, :max_lag + 1]
+    sums = lagged(x)
+    pairs = np.round(lagged(mask)).astype(int)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = np.where(pairs > 0, sums / (pairs + np.arange(max_lag + 1)), np.nan)  ## As R's acf0
+        acf = cov / cov[:, :1]
+    return acf, pairs
+
+
+def batchedPACF(acf):
+    '''
+    PACF (subjects, lags) from the ACF by Durbin-Levinson;
+    lag 0 is 1 by convention
+    '''
+    n_subjects, n_lags = acf.shape
+    pacf = np.full(acf.shape, np.nan)
+    pacf[:, 0] = 1.0
+    phi = np.zeros((n_subjects, n_lags))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for k in range(1, n_lags):
+            prev = phi[:, 1:k]
+            num = acf[:, k] - (prev * acf[:, k - 1:0:-1]).sum(axis=1)
+            den = 1 - (prev * acf[:, 1:k]).sum(axis=1)
+            pacf[:, k] = num / den
+            phi[:, 1:k] = prev - pacf[:, k:k + 1] * prev[:, ::-1]
+            phi[:, k] = pacf[:, k]
+    return pacf
+
+
+def stepsLagStructure(cube_dir=CUBE_DIR, max_lag=MAX_LAG, metric='TotalSteps'):
+    '''
+    Returns (table, summary) as described above, for one metric of the cube
+    '''
+    cube, subjects, metrics = loadCube(cube_dir)
+    series = np.asarray(cube[:, :, metrics.index(metric)], dtype=float)
+    acf, pairs = batchedACF(series, max_lag)
+    pacf = batchedPACF(acf)
+    n_days = (~np.isnan(series)).sum(axis=1)
+
+    lags = np.arange(max_lag + 1)
+    table = pd.DataFrame({'sub': np.repeat(subjects['sub'].values, len(lags)),
+                          'lag': np.tile(lags, len(subjects)),
+                          'acf': acf.ravel(), 'pacf': pacf.ravel(), 'n_pairs': pairs.ravel()})
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        significant = np.abs(pacf) > 1.96 / np.sqrt(n_days)[:, None]
+    summary = pd.DataFrame({'lag': lags,
+                            'acf_mean': np.nanmean(acf, axis=0), 'acf_median': np.nanmedian(acf, axis=0),
+                            'pacf_mean': np.nanmean(pacf, axis=0), 'pacf_median': np.nanmedian(pacf, axis=0),
+                            'share_pacf_significant': significant.mean(axis=0),
+                            'n_subjects': (~np.isnan(acf)).sum(axis=0)})
+    return table, summary
+
+
+def writeLagStructure(cube_dir=CUBE_DIR, out_dir="data_clean", max_lag=MAX_LAG):
+    table, summary = stepsLagStructure(cube_dir, max_lag)
+    table.to_csv(os.path.join(out_dir, "steps_acf.csv"), index=False)
+    summary.to_csv(os.path.join(out_dir, "steps_acf_summary.csv"), index=False)
+    return summary
+
+
+if __name__ == "__main__":
+    with pd.option_context('display.width', 200):
+        print(writeLagStructure().to_string(index=False, float_format=lambda x: '%.3f' % x))
@@ -18,6 +18,12 @@ HOW TO RUN
         3. SMS data logs for each individual - TextMagic
         4. fMRI data (2 files) for each individual - Server/Cluster
         5. Daily surveys (1 combined file with all participants) - Redcap
+        6. (Optional) Minute steps and minute intensities logs
+           for each individual - Fitabase (see intradayData.py)
+        7. (Optional) Heart rate (seconds) logs for each
+           individual - Fitabase (see heartrateData.py)
+        8. Demographics (REDCap visit export, file name
+           starting with 'Demographics') - Redcap
     
     The script calls mergeData with a list of participant id numbers
     as strings and returns a large combined file for all participants.
@@ -32,6 +38,18 @@ import pandas as pd
 import numpy as np
 import os
 
+from intradayData import intradayFeatures, intradayColumns
+from heartrateData import heartrateFeatures, heartrateColumns
+from dailyAlignment import collapseToDays, reportDuplicates, SMS_RULES, SURVEY_RULES
+from rawFiles import RawFileReader
+from activityCube import writeCube, CUBE_DIR
+from lagStructure import writeLagStructure
+from messageIndex import MessageIndex
+from subjectSummary import SubjectSummary
+from demographics import loadDemographics, attachDemographics
+from dailyStore import ingestExports, STORE_DIR
+from surveyStore import ingestSurveys, newestExport, storedSurveysFile
+
 
 def safeDateConvert(val, verbose=False):
     '''
@@ -75,7 +93,7 @@ def dateToUnix(date):
         return (pd.to_datetime([date]).astype(int) / 10**9)[0].astype(int)
 
 
-def mergeFilesForUser(uid, write_csv=False):
+def mergeFilesForUser(uid, write_csv=False, files=None, summary=None):
     '''
     Merge the following: 
        * Daily activity FitBit data (one file per subject)
@@ -92,16 +110,25 @@ def mergeFilesForUser(uid, write_csv=False):
         'data_clean'
     which should be created beforehand in the same 
     directory as this script.
+    
+    files is the user's UserFiles from a RawFileReader (see rawFiles.py),
+    if their files are already being read; otherwise they are read here.
+    
+    summary is the SubjectSummary table (see subjectSummary.py) to
+    update with this user's row; a new, unsaved one if not given.
     '''
     path_to_data = os.path.join("data_raw", "")
+    if files is None:
+        reader = RawFileReader([uid], path_to_data)
+        files = reader.files(uid)
+        reader.close()
     
     # Find fitabase files for user
-    fitabase_files = [f for f in os.listdir(path_to_data) if f.startswith(uid)]
+    fitabase_files = files.fitabase_files
     
     # Load activity file for user, load dataframe, and re-format date
     try:
-        activityFile = [f for f in fitabase_files if "Activity" in f][0]
-        userActivity = pd.read_csv(path_to_data + activityFile)
+        userActivity = files.read('activity')
         userActivity['ActivityDate'] = userActivity['ActivityDate'].apply(formatDate)
     except:
         print("No activity data for uid " + uid + "; aborting for this participant")
@@ -109,8 +136,7 @@ def mergeFilesForUser(uid, write_csv=False):
 
     # Load sleep file for user, load dataframe, and re-format date
     try:
-        sleepFile = [f for f in fitabase_files if "sleep" in f][0]
-        sleepLog = pd.read_csv(path_to_data + sleepFile)
+        sleepLog = files.read('sleep')
         sleepLog['DateToFormat'] = sleepLog['SleepDay'].apply(safeDateConvert)
         sleepLog['DateToMerge'] = sleepLog['DateToFormat'].apply(formatDate)
         # Merge with activity data using date
@@ -122,18 +148,18 @@ def mergeFilesForUser(uid, write_csv=False):
     # Find SMS data file, load dataframe, clean up subject day numbers,
     # and re-format the survey timestamp (to keep only the date)
     try:
-        smsData = pd.read_csv(path_to_data + "sub-" + uid + "_sms-times.csv") 
+        smsData = files.read('sms')
         smsData.rename(columns={'Unnamed: 0':'subj_day_num'}, inplace=True)
         smsData['subj_day_num'] = smsData['subj_day_num'].apply(lambda x: x+1)
     
-        smsDates = smsData['timestamp'].apply(safeDateConvert)
-        smsDatesClean = smsDates[smsDates != "N/A"]
-        smsData['SmsDate'] = smsDatesClean
+        # One row per SMS date, so a day with two messages doesn't duplicate the activity row
+        smsDays, smsDuplicates = collapseToDays(smsData, 'timestamp', 'SmsDate', SMS_RULES)
+        reportDuplicates(uid, "SMS", smsDuplicates)
         
-        msgStartDate = pd.Timestamp(smsData['SmsDate'][0])
+        msgStartDate = pd.Timestamp(smsDays['SmsDate'][0])
     
         # Merge survey and SMS rows using date
-        act_SMS = pd.merge(act_sleep, smsData, how='left', left_on='ActivityDate', right_on='SmsDate')
+        act_SMS = pd.merge(act_sleep, smsDays, how='left', left_on='ActivityDate', right_on='SmsDate')
         act_SMS['msg_start'] = act_SMS['ActivityDate'].apply(lambda x: 0 if pd.Timestamp(x) < msgStartDate else 1)
     
         # Re-order columns of merged dataframe
@@ -145,26 +171,42 @@ def mergeFilesForUser(uid, write_csv=False):
         print("Missing SMS data for uid " + uid)
         act_SMS = act_sleep
         smsPresent = False
+
+    # Add daily features from minute-level Fitabase files, if there are any
+    # (steps after each SMS, and steps/intensity profiles over the day)
+    smsTimes = pd.to_datetime(smsData['timestamp'], errors='coerce').dropna() if smsPresent else None
+    intraday = intradayFeatures(fitabase_files, path_to_data, smsTimes)
+    if intraday is not None:
+        act_SMS = pd.merge(act_SMS, intraday, how='left', left_on='ActivityDate', right_index=True)
+
+    heartrate = heartrateFeatures(fitabase_files, path_to_data, smsTimes)
+    if heartrate is not None:
+        act_SMS = pd.merge(act_SMS, heartrate, how='left', left_on='ActivityDate', right_index=True)
+        # Days without any HR samples were not worn at all
+        minuteCols = [c for c in heartrate.columns if c.endswith('_minutes')]
+        act_SMS[minuteCols] = act_SMS[minuteCols].fillna(0).astype(int)
         
     # Find combined survey data file, load dataframe
     # and re-format survey timestamp (keep only the date)
-    surveyFiles = [f for f in os.listdir(path_to_data) if f.startswith("DailySurveys")]
+    surveyFiles = [f for f in files.listing if f.startswith("DailySurveys")]
     if len(surveyFiles) > 0:
         # Notify if there are multiple survey files
         if len(surveyFiles) > 1:
-            print(str(len(surveyFiles)) + " DailySurveys files found. Using file: " + surveyFiles[0] + "\n")
+            print(str(len(surveyFiles)) + " DailySurveys files found. Using file: " + newestExport(surveyFiles) + "\n")
         
         # Load surveys dataframe and clean data
-        surveyData = pd.read_csv(path_to_data + surveyFiles[0]) 
-        surveyDates = surveyData['daily_survey_timestamp'].apply(safeDateConvert)
-        surveyDatesClean = surveyDates[surveyDates != "N/A"]
-        surveyData['SurveyDate'] = surveyDatesClean
+        surveyData = files.read('surveys')
         
         # Find this user's rows in the survey dataframe and store in new dataframe
         surveyDataForUser = surveyData.loc[surveyData['subject_id'] == int(uid)]
         if surveyDataForUser.size == 0: # Sometimes these are stored as strings instead
             surveyDataForUser = surveyData.loc[surveyData['subject_id'] == uid]
         
+        # One row per survey date (repeat entries on a day are combined)
+        surveyDataForUser, surveyDuplicates = collapseToDays(surveyDataForUser, 'daily_survey_timestamp',
+                                                             'SurveyDate', SURVEY_RULES)
+        reportDuplicates(uid, "survey", surveyDuplicates)
+        
         # Merge activity/SMS and survey rows using date 
         # and fill survey cols with 'NA' if surveys are missing
         act_SMS_surveys = pd.merge(act_SMS, surveyDataForUser, how='left', left_on='ActivityDate', right_on='SurveyDate')
@@ -186,13 +228,13 @@ def mergeFilesForUser(uid, write_csv=False):
     
     # Read in the subject's two fMRI runs as dataframes and label rows with run number
     try:
-        run1 = pd.read_csv(path_to_data + "sub-" + uid + "_task-HealthMessage_run-01_events.tsv", sep='\t')
+        run1 = files.read('run-01')
         run1['run'] = '01'
     except:
         print("Missing fmri run 01 for uid " + uid)
         run1 = pd.DataFrame()
     try:
-        run2 = pd.read_csv(path_to_data + "sub-" + uid + "_task-HealthMessage_run-02_events.tsv", sep='\t')
+        run2 = files.read('run-02')
         run2['run'] = '02'
     except:
         print("Missing fmri run 02 for uid " + uid)
@@ -207,11 +249,18 @@ def mergeFilesForUser(uid, write_csv=False):
     else:
         final_merged = act_SMS_surveys
 
-    # Normalize TotalSteps and RestingHeartRate from daily activity
+    # Update the user's row of the subject summary (one value per day)
+    if summary is None:
+        summary = SubjectSummary(summary_file=None)
+    n_sms = len(smsData) if smsPresent else 0
+    ratings = final_merged.loc[final_merged['trial_type'] == "rating", 'rating'] if 'trial_type' in final_merged else None
+    userSummary = summary.update(uid, final_merged.drop_duplicates(subset=['ActivityDate']), n_sms, ratings)
+
+    # Normalize TotalSteps and RestingHeartRate from daily activity, using the user's summary
     totSteps = final_merged['TotalSteps'].apply(lambda x: int(x) if x != "NA" else np.NaN)
     restingHR = final_merged['RestingHeartRate'].apply(lambda x: int(x) if x != "NA" else np.NaN)
-    final_merged['TotalSteps_norm'] = (final_merged['TotalSteps'] - totSteps.mean()) / totSteps.std()
-    final_merged['RestingHeartRate_norm'] = (restingHR - restingHR.mean()) / restingHR.std()
+    final_merged['TotalSteps_norm'] = (totSteps - userSummary['TotalSteps_mean']) / userSummary['TotalSteps_sd']
+    final_merged['RestingHeartRate_norm'] = (restingHR - userSummary['RestingHeartRate_mean']) / userSummary['RestingHeartRate_sd']
     
     # Re-format column names and null values
     final_merged.rename(columns={'daily_survey_timestamp':'survey_complete_timestamp',
@@ -231,6 +280,10 @@ def mergeFilesForUser(uid, write_csv=False):
                  'valence', 's_ns', 'msg_id', 'message',
                  'survey_complete_timestamp', 'location', 'lap', 'hap', 'han', 'lan', 'la', 'p', 'n', 'ha', 'self_efficacy_daily',
                  'TotalSleepRecords', 'TotalMinutesAsleep', 'TotalMinutesLight', 'TotalMinutesDeep', 'TotalMinutesREM']
+    if any(("minuteSteps" in f) or ("minuteIntensities" in f) for f in files.listing):
+        finalCols += intradayColumns()  ## Only when there is minute-level data for the cohort
+    if any("heartrate_seconds" in f for f in files.listing):
+        finalCols += heartrateColumns()
     
     # Fill columns with NA if data was missing (column doesn't exist)
     finalColsDiff = set(finalCols) - set(final_merged.columns)
@@ -265,35 +318,83 @@ def mergeFilesForUser(uid, write_csv=False):
     return final_ret
 
 
-def mergeData(uids, individual_files=True):
+def mergeData(uids, individual_files=True, cube=False, message_index=False, use_store=False):
     '''
     Create one ouput file with
     all runs of all subjects;
     
     if individual_files is True,
     additionally create two ouput
-    files per subject, one for each fMRI run
+    files per subject, one for each fMRI run;
+    
+    if cube is True, also write the daily
+    measures as a subject x day x metric
+    array (see activityCube.py), and the
+    steps ACF/PACF computed from it
+    (see lagStructure.py);
+    
+    if message_index is True, add any new
+    message days to the per-message index
+    (see messageIndex.py);
+    
+    if use_store is True, first add new
+    Fitabase exports to the daily store, and
+    read daily activity and sleep from it
+    (see dailyStore.py); likewise add the new
+    rows of the newest DailySurveys export to
+    the survey store and read surveys from it
+    (see surveyStore.py)
     '''
     # Notify if there is no combined survey file
     surveyFiles = [f for f in os.listdir(path_to_data) if f.startswith("DailySurveys")]
     if len(surveyFiles) == 0:
         print("DailySurveys file not found. Make sure the file name starts with: 'DailySurveys'" + "\n")
     
+    # Upsert new and changed days from any new Fitabase exports
+    if use_store:
+        ingested = ingestExports(path_to_data, os.listdir(path_to_data), STORE_DIR)
+        print("%d new exports ingested: %d days added, %d changed" %
+              (len(ingested), ingested['days_added'].sum(), ingested['days_changed'].sum()))
+        print("%d new survey rows ingested" % ingestSurveys(path_to_data, os.listdir(path_to_data)))
+    
     # Get individual dataframes for each subject number
+    # (the next few subjects' files are read in the background meanwhile)
+    reader = RawFileReader(uids, path_to_data, store_dir=STORE_DIR if use_store else None,
+                           survey_file=storedSurveysFile() if use_store and surveyFiles else None)
+    summary = SubjectSummary()
     dataframes = []
     for uid in uids:
-        df = mergeFilesForUser(uid, write_csv = individual_files)
+        df = mergeFilesForUser(uid, write_csv = individual_files, files = reader.files(uid), summary = summary)
         if df is not None:
             dataframes.append(df)
         else: # Something went wrong
             print("uid " + uid + " will not be in combined file")
+    reader.close()
+    
+    # One row per subject of demographics, for the summary table and the combined file
+    demographics = loadDemographics(path_to_data, reader.listing)
+    if demographics is None:
+        print("Demographics file not found. Make sure the file name starts with: 'Demographics'" + "\n")
+    else:
+        summary.addDemographics(demographics)
+    summary.save()
     
     # Concatenate individual dataframes together
     # and sort rows by subject number and activity date
     if len(dataframes) > 0:
         allInOne = pd.concat(dataframes)
+        if demographics is not None:
+            allInOne = attachDemographics(allInOne, demographics)
         allInOne = allInOne.sort_values(by=['sub', 'ActivityDate'])
         pd.DataFrame.to_csv(allInOne, os.path.join("data_clean" ,"final_merged_data_all_norm.csv"), index=False)
+        if cube:
+            writeCube(allInOne, CUBE_DIR)
+            writeLagStructure(CUBE_DIR, "data_clean")
+        if message_index:
+            index = MessageIndex()
+            added = index.update(allInOne)
+            index.save()
+            print(str(added) + " new message days added to the message index")
     else:
         print("No valid participant IDs; no combined file written")
 
@@ -314,5 +415,5 @@ if __name__ == "__main__":
     #uids = ['1011', '1105']
     
     # Output files for these subjects
-    mergeData(uids, individual_files=True)
+    mergeData(uids, individual_files=True, cube=True, message_index=True)
     
\ No newline at end of file
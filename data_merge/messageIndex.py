@@ -0,0 +1,161 @@
+'''
+Running per-message effectiveness statistics, updated as subject-days
+are merged, so message leaderboards never need the full merged file.
+
+For every message (msg_id, with its valence and s_ns) the index keeps
+sufficient statistics (counts, sums and sums of squares) of:
+    delta       -- steps on the day the message was sent, minus the
+                   subject's baseline (mean steps before messaging began)
+    next_delta  -- the same for the following day
+    rating      -- the subject's fMRI rating of the message, with
+                   its cross-products with delta (for the correlation)
+Sums add, so any grouping (e.g. by valence and s_ns) is summarized
+from them without revisiting the data.
+
+The index is saved in data_clean as message_index.csv, with the
+(sub, ActivityDate) days already counted in message_index_days.csv;
+days already counted are skipped, so re-merging is harmless. A day
+whose following day has not been merged yet is counted without its
+next_delta, which is added by the first update that has it
+(next_counted in the days file).
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+KEYS = ['msg_id', 'valence', 's_ns']
+STATS = ['n', 'sum_delta', 'sumsq_delta',
+         'n_next', 'sum_next', 'sumsq_next',
+         'n_rated', 'sum_rating', 'sumsq_rating', 'sum_rated_delta', 'sumsq_rated_delta', 'sum_rating_delta']
+NEXT_STATS = ['n_next', 'sum_next', 'sumsq_next']
+INDEX_FILE = os.path.join("data_clean", "message_index.csv")
+DAYS_FILE = os.path.join("data_clean", "message_index_days.csv")
+
+
+def dailyContributions(merged):
+    '''
+    One row per message day in a merged dataframe (as written by
+    mergeData, with "NA" for missing values): its keys and its
+    terms of each statistic
+    '''
+    merged = merged.replace("NA", np.nan)
+    ratings = merged.loc[merged['trial_type'] == "rating", ['sub', 'ActivityDate', 'rating']] \
+        .drop_duplicates(subset=['sub', 'ActivityDate'])
+    days = merged.drop_duplicates(subset=['sub', 'ActivityDate']).drop(columns=['rating'])
+    days = days.merge(ratings, how='left', on=['sub', 'ActivityDate'])
+
+    days['TotalSteps'] = pd.to_numeric(days['TotalSteps'], errors='coerce')
+    days['msg_start'] = pd.to_numeric(days['msg_start'], errors='coerce')
+    days['rating'] = pd.to_numeric(days['rating'], errors='coerce')
+    days['date'] = pd.to_datetime(days['ActivityDate'])
+
+    baseline = days.loc[days['msg_start'] == 0].groupby('sub')['TotalSteps'].mean()
+    days['delta'] = days['TotalSteps'] - days['sub'].map(baseline)
+    nextDay = days[['sub', 'date', 'delta']].assign(date=days['date'] - pd.Timedelta(days=1))
+    days = days.merge(nextDay.rename(columns={'delta': 'next_delta'}), how='left', on=['sub', 'date'])
+
+    days = days.dropna(subset=['msg_id', 'delta'])
+    rated = days['rating'].notna()
+    next_ok = days['next_delta'].notna()
+    terms = days[['sub', 'ActivityDate'] + KEYS].copy()
+    terms['msg_id'] = pd.to_numeric(terms['msg_id']).astype(int)
+    terms['n'] = 1
+    terms['sum_delta'] = days['delta']
+    terms['sumsq_delta'] = days['delta'] ** 2
+    terms['n_next'] = next_ok.astype(int)
+    terms['sum_next'] = days['next_delta'].where(next_ok, 0)
+    terms['sumsq_next'] = (days['next_delta'] ** 2).where(next_ok, 0)
+    terms['n_rated'] = rated.astype(int)
+    terms['sum_rating'] = days['rating'].where(rated, 0)
+    terms['sumsq_rating'] = (days['rating'] ** 2).where(rated, 0)
+    terms['sum_rated_delta'] = days['delta'].where(rated, 0)
+    terms['sumsq_rated_delta'] = (days['delta'] ** 2).where(rated, 0)
+    terms['sum_rating_delta'] = (days['rating'] * days['delta']).where(rated, 0)
+    return terms
+
+
+def summarizeStats(stats):
+    '''
+    Means, SDs and the rating-delta correlation from summed statistics
+    '''
+    out = stats[['n', 'n_next', 'n_rated']].copy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name, n, s, ss in [('delta', 'n', 'sum_delta', 'sumsq_delta'),
+                               ('next_delta', 'n_next', 'sum_next', 'sumsq_next'),
+                               ('rating', 'n_rated', 'sum_rating', 'sumsq_rating')]:
+            mean = stats[s] / stats[n]
+            var = (stats[ss] - stats[n] * mean ** 2) / (stats[n] - 1)
+            out['mean_' + name] = mean
+            out['sd_' + name] = np.sqrt(var.clip(lower=0))
+            out['se_' + name] = out['sd_' + name] / np.sqrt(stats[n])
+        n = stats['n_rated']
+        cov = stats['sum_rating_delta'] - stats['sum_rating'] * stats['sum_rated_delta'] / n
+        varRating = stats['sumsq_rating'] - stats['sum_rating'] ** 2 / n
+        varDelta = stats['sumsq_rated_delta'] - stats['sum_rated_delta'] ** 2 / n
+        out['rating_delta_corr'] = cov / np.sqrt(varRating * varDelta)
+    return out
+
+
+class MessageIndex(object):
+    '''
+    The saved index: load with MessageIndex(), add merged subject-days
+    with update(), query with leaderboard(), and save()
+    '''
+
+    def __init__(self, index_file=INDEX_FILE, days_file=DAYS_FILE):
+        self.index_file = index_file
+        self.days_file = days_file
+        if os.path.exists(index_file):
+            self.stats = pd.read_csv(index_file, index_col=KEYS)
+        else:
+            self.stats = pd.DataFrame(columns=KEYS + STATS).set_index(KEYS)
+        self.days = set()
+        self.nextDays = set()  ## Days whose next_delta is counted too
+        if os.path.exists(days_file):
+            counted = pd.read_csv(days_file, dtype=str)
+            if 'next_counted' not in counted:
+                counted['next_counted'] = "1"
+            for sub, date, nextCounted in counted[['sub', 'ActivityDate', 'next_counted']].values:
+                self.days.add((sub, date))
+                if nextCounted == "1":
+                    self.nextDays.add((sub, date))
+
+    def update(self, merged):
+        '''
+        Adds the message days of a merged dataframe that are not
+        already counted, and the next_delta of counted days whose
+        following day is new; returns how many days were added
+        '''
+        terms = dailyContributions(merged)
+        keys = list(zip(terms['sub'].astype(str), terms['ActivityDate'].astype(str)))
+        new = np.array([k not in self.days for k in keys], dtype=bool)
+        newNext = np.array([k not in self.nextDays for k in keys], dtype=bool) & (terms['n_next'].values == 1)
+        if not (new.any() or newNext.any()):
+            return 0
+        contributions = terms[KEYS + STATS].copy()
+        sameDay = [s for s in STATS if s not in NEXT_STATS]
+        contributions.loc[~new, sameDay] = 0
+        contributions.loc[~newNext, NEXT_STATS] = 0
+        added = contributions.loc[new | newNext].groupby(KEYS)[STATS].sum()
+        self.stats = self.stats.add(added, fill_value=0) if len(self.stats) else added
+        self.days.update(k for k, isNew in zip(keys, new) if isNew)
+        self.nextDays.update(k for k, isNew in zip(keys, newNext) if isNew)
+        return int(new.sum())
+
+    def leaderboard(self, by=KEYS, min_n=1, sort_by='mean_delta'):
+        '''
+        Summary per message (or per group of messages, e.g.
+        by=['valence', 's_ns']), best first
+        '''
+        stats = self.stats.groupby(level=by).sum() if list(by) != KEYS else self.stats
+        table = summarizeStats(stats)
+        return table.loc[table['n'] >= min_n].sort_values(sort_by, ascending=False)
+
+    def save(self):
+        self.stats.to_csv(self.index_file)
+        days = pd.DataFrame(sorted(self.days), columns=['sub', 'ActivityDate'])
+        days['next_counted'] = [int(d in self.nextDays) for d in sorted(self.days)]
+        days.to_csv(self.days_file, index=False)
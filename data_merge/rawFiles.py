@@ -0,0 +1,125 @@
+'''
+Concurrent reading of the small per-participant raw files
+(daily activity, sleep, SMS times, the two fMRI runs, and the
+combined daily surveys file), for when 'data_raw' is on a network
+share and each file open costs more than parsing it.
+
+RawFileReader lists 'data_raw' once, then reads the files of the
+next few participants on a thread pool while the current one is
+being merged. Only the columns the merged output needs are parsed.
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from dailyStore import storeFile
+from surveyStore import newestExport
+
+
+## Columns used by mergeFilesForUser() for each kind of file
+USECOLS = {
+    'activity': ['ActivityDate', 'TotalSteps', 'TotalDistance', 'VeryActiveDistance', 'ModeratelyActiveDistance',
+                 'LightActiveDistance', 'SedentaryActiveDistance', 'VeryActiveMinutes', 'FairlyActiveMinutes',
+                 'LightlyActiveMinutes', 'SedentaryMinutes', 'Calories', 'Floors', 'CaloriesBMR',
+                 'MarginalCalories', 'RestingHeartRate'],
+    'sleep': ['SleepDay', 'TotalSleepRecords', 'TotalMinutesAsleep', 'TotalMinutesLight',
+              'TotalMinutesDeep', 'TotalMinutesREM'],
+    'sms': ['Unnamed: 0', 'timestamp', 'unix_timestamp', 'valence', 's_ns', 'id', 'message'],
+    'run': ['onset', 'duration', 'trial', 'trial_type', 'rating', 'resp_time', 'id'],
+    'surveys': ['subject_id', 'daily_survey_timestamp', 'location', 'lap', 'hap', 'han', 'lan',
+                'la', 'p', 'n', 'ha', 'self_efficacy_daily'],
+}
+
+
+def readRaw(path, kind, **kwargs):
+    '''
+    Reads one raw file, parsing only the columns listed for its kind
+    (columns missing from the file are skipped, not an error)
+    '''
+    wanted = set(USECOLS[kind])
+    return pd.read_csv(path, usecols=lambda c: c in wanted, **kwargs)
+
+
+class UserFiles(object):
+    '''
+    One participant's raw files, as they finish loading; read() returns
+    a file's dataframe, or raises the error from reading it (e.g. a
+    missing file), just as calling pd.read_csv directly would
+    '''
+
+    def __init__(self, uid, listing, futures):
+        self.uid = uid
+        self.listing = listing
+        self.fitabase_files = [f for f in listing if f.startswith(uid)]
+        self._futures = futures
+
+    def read(self, name):
+        if name not in self._futures:
+            raise IOError("No %s file for uid %s" % (name, self.uid))
+        return self._futures[name].result().copy()  ## Callers modify their frames
+
+
+class RawFileReader(object):
+    '''
+    Prefetches participants' raw files on a pool of threads.
+
+    files(uid) returns that participant's UserFiles and starts reading
+    the files of the next `lookahead` participants (in the order given
+    to the constructor). The combined surveys file (the newest export,
+    or survey_file if given) is read only once.
+    With a store_dir, daily activity and sleep come from the daily
+    store (see dailyStore.py) instead of the exports.
+    '''
+
+    def __init__(self, uids, path_to_data, n_threads=8, lookahead=2, store_dir=None, survey_file=None):
+        self.uids = list(uids)
+        self.path_to_data = path_to_data
+        self.store_dir = store_dir
+        self.lookahead = lookahead
+        self.listing = os.listdir(path_to_data)
+        self._pool = ThreadPoolExecutor(max_workers=n_threads)
+        self._pending = {}
+
+        if survey_file is None and newestExport(self.listing) is not None:
+            survey_file = path_to_data + newestExport(self.listing)
+        self._surveys = self._pool.submit(readRaw, survey_file, 'surveys') if survey_file is not None else None
+
+    def _submit(self, uid):
+        fitabase_files = [f for f in self.listing if f.startswith(uid)]
+        paths = {}
+        if self.store_dir is not None:
+            for kind in ['activity', 'sleep']:
+                if os.path.exists(storeFile(self.store_dir, kind, uid)):
+                    paths[kind] = (storeFile(self.store_dir, kind, uid), kind, {})
+        else:
+            activityFiles = [f for f in fitabase_files if "Activity" in f]
+            if activityFiles:
+                paths['activity'] = (self.path_to_data + activityFiles[0], 'activity', {})
+            sleepFiles = [f for f in fitabase_files if "sleep" in f]
+            if sleepFiles:
+                paths['sleep'] = (self.path_to_data + sleepFiles[0], 'sleep', {})
+        paths['sms'] = (self.path_to_data + "sub-" + uid + "_sms-times.csv", 'sms', {})
+        for run in ['01', '02']:
+            paths['run-' + run] = (self.path_to_data + "sub-" + uid + "_task-HealthMessage_run-" + run + "_events.tsv",
+                                   'run', {'sep': '\t'})
+
+        futures = {name: self._pool.submit(readRaw, path, kind, **kwargs)
+                   for name, (path, kind, kwargs) in paths.items()}
+        if self._surveys is not None:
+            futures['surveys'] = self._surveys
+        self._pending[uid] = UserFiles(uid, self.listing, futures)
+
+    def files(self, uid):
+        if uid not in self._pending:
+            self._submit(uid)
+        if uid in self.uids:
+            i = self.uids.index(uid)
+            for nextUid in self.uids[i + 1:i + 1 + self.lookahead]:
+                if nextUid not in self._pending:
+                    self._submit(nextUid)
+        return self._pending.pop(uid)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,101 @@
+'''
+Per-subject summary table, one row per participant, kept up to date
+by the merge so that normalization and later analyses read subject
+level numbers from it instead of rescanning the daily rows.
+
+Columns:
+    sub, first_date, last_date, n_days   -- activity days merged
+    msg_start_date, n_sms                -- first messaging day, SMS received
+    n_survey_days                        -- days with a daily survey
+    days_zero_steps                      -- days with TotalSteps of 0
+    <metric>_n, <metric>_missing,        -- for each metric in METRICS, over
+    <metric>_mean, <metric>_sd              the subject's days (one value per day)
+    age, gender                          -- from the REDCap export, if any
+                                            (see demographics.py)
+    rating_n, rating_mean, rating_sd     -- the subject's fMRI message ratings
+                                            (one per rated message)
+
+Saved as data_clean/subject_summary.csv; merging a subject again
+replaces that subject's row and leaves the others as they were.
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+METRICS = ['TotalSteps', 'RestingHeartRate', 'TotalMinutesAsleep', 'VeryActiveMinutes',
+           'FairlyActiveMinutes', 'LightlyActiveMinutes', 'SedentaryMinutes', 'self_efficacy_daily']
+SUMMARY_FILE = os.path.join("data_clean", "subject_summary.csv")
+
+
+def summarizeDays(uid, days, n_sms=0, ratings=None):
+    '''
+    Summary row (a dict) for one subject from their daily rows
+    (one per ActivityDate; "NA" or NaN where missing) and the
+    ratings of their fMRI 'rating' trials
+    '''
+    days = days.replace("NA", np.nan)
+    dates = pd.to_datetime(days['ActivityDate'])
+    row = {'sub': int(uid),
+           'first_date': dates.min().strftime("%Y-%m-%d"),
+           'last_date': dates.max().strftime("%Y-%m-%d"),
+           'n_days': len(days),
+           'msg_start_date': np.nan,
+           'n_sms': n_sms,
+           'n_survey_days': int(days['daily_survey_timestamp'].notna().sum()) if 'daily_survey_timestamp' in days else 0}
+
+    if 'msg_start' in days:
+        messaging = dates[pd.to_numeric(days['msg_start'], errors='coerce') == 1]
+        if len(messaging) > 0:
+            row['msg_start_date'] = messaging.min().strftime("%Y-%m-%d")
+
+    steps = pd.to_numeric(days['TotalSteps'], errors='coerce') if 'TotalSteps' in days else pd.Series(dtype=float)
+    row['days_zero_steps'] = int((steps == 0).sum())
+
+    for metric in METRICS:
+        values = pd.to_numeric(days[metric], errors='coerce') if metric in days else pd.Series(np.nan, index=days.index)
+        row[metric + '_n'] = int(values.notna().sum())
+        row[metric + '_missing'] = int(values.isna().sum())
+        row[metric + '_mean'] = values.mean()
+        row[metric + '_sd'] = values.std()
+
+    ratings = pd.to_numeric(pd.Series(ratings if ratings is not None else [], dtype=object).replace("NA", np.nan),
+                            errors='coerce').dropna()
+    row['rating_n'] = len(ratings)
+    row['rating_mean'] = ratings.mean()
+    row['rating_sd'] = ratings.std()
+    return row
+
+
+class SubjectSummary(object):
+    '''
+    The saved summary table: update(uid, days, n_sms, ratings)
+    recomputes one subject's row and returns it; save() writes the table
+    (summary_file=None keeps it in memory only)
+    '''
+
+    def __init__(self, summary_file=SUMMARY_FILE):
+        self.summary_file = summary_file
+        if summary_file is not None and os.path.exists(summary_file):
+            self.table = pd.read_csv(summary_file, index_col='sub')
+        else:
+            self.table = pd.DataFrame()
+
+    def update(self, uid, days, n_sms=0, ratings=None):
+        row = pd.DataFrame([summarizeDays(uid, days, n_sms, ratings)]).set_index('sub')
+        others = self.table.drop(index=row.index, errors='ignore')
+        self.table = pd.concat([others, row]) if len(others) else row
+        return self.table.loc[row.index[0]]
+
+    def addDemographics(self, demographics):
+        '''
+        Sets the age and gender columns from the demographics table
+        '''
+        self.table = self.table.drop(columns=['age', 'gender'], errors='ignore') \
+            .join(demographics[['age', 'gender']])
+
+    def save(self):
+        if self.summary_file is not None:
+            self.table.sort_index().to_csv(self.summary_file)
@@ -0,0 +1,86 @@
+'''
+Incremental ingest of the cumulative REDCap daily survey exports
+(DailySurveys_DATA_<YYYY-MM-DD>_<HHMM>.csv) into a compact parsed store.
+
+record_id only ever increases, so a row is new exactly when its
+record_id is past the last one already stored: the newest export (by
+the timestamp in its name) is read in full (it is small, and REDCap
+may have removed rows from it), and only the new rows are parsed
+further and appended. Rows removed in REDCap since the last export
+do not matter, as rows are picked by record_id, not by position.
+
+Store (data_clean/survey_store by default):
+    surveys.csv  -- record_id and the survey columns the merge uses,
+                    with daily_survey_timestamp normalized to
+                    YYYY-MM-DD HH:MM:SS (empty if it isn't a valid time)
+    state.csv    -- high-water mark: last_record_id, and the export
+                    it came from
+'''
+
+import os
+import re
+
+import pandas as pd
+
+
+STORE_DIR = os.path.join("data_clean", "survey_store")
+EXPORT_PATTERN = re.compile(r'^DailySurveys.*_(?P<stamp>\d{4}-\d{2}-\d{2}_\d{4})\.csv$')
+## REDCap survey timestamps, with or without seconds
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M")
+COLUMNS = ['record_id', 'subject_id', 'daily_survey_timestamp', 'location', 'lap', 'hap', 'han', 'lan',
+           'la', 'p', 'n', 'ha', 'self_efficacy_daily']
+
+
+def newestExport(listing):
+    '''
+    The DailySurveys export with the latest timestamp in its name
+    (exports without one count as oldest), or None
+    '''
+    exports = [f for f in listing if f.startswith("DailySurveys")]
+    if not exports:
+        return None
+    stamp = lambda f: EXPORT_PATTERN.match(f).group('stamp') if EXPORT_PATTERN.match(f) else ""
+    return max(exports, key=lambda f: (stamp(f), f))
+
+
+def ingestSurveys(path_to_data, listing, store_dir=STORE_DIR):
+    '''
+    Appends the newest export's new rows to the store;
+    returns the number of rows added
+    '''
+    export = newestExport(listing)
+    if export is None:
+        return 0
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    stateFile = os.path.join(store_dir, "state.csv")
+    storeFile = os.path.join(store_dir, "surveys.csv")
+
+    lastRecord = 0
+    if os.path.exists(stateFile) and os.path.exists(storeFile):
+        state = pd.read_csv(stateFile).iloc[0]
+        if state['export'] == export:
+            return 0  ## Exports don't change once written
+        lastRecord = int(state['last_record_id'])
+
+    wanted = set(COLUMNS)
+    rows = pd.read_csv(path_to_data + export, usecols=lambda c: c in wanted, dtype=str, encoding='utf-8-sig')
+    rows['record_id'] = pd.to_numeric(rows['record_id'], errors='coerce')
+    rows = rows.loc[rows['record_id'] > lastRecord]
+    times = pd.Series(pd.NaT, index=rows.index)
+    for fmt in TIME_FORMATS:
+        times = times.fillna(pd.to_datetime(rows['daily_survey_timestamp'], format=fmt, errors='coerce'))
+    rows = rows.reindex(columns=COLUMNS)
+    rows['daily_survey_timestamp'] = times.dt.strftime("%Y-%m-%d %H:%M:%S")
+    rows['record_id'] = rows['record_id'].astype(int)
+
+    if len(rows):
+        rows.to_csv(storeFile, mode='a', header=not os.path.exists(storeFile), index=False)
+        lastRecord = int(rows['record_id'].max())
+    pd.DataFrame([{'last_record_id': lastRecord, 'export': export}]) \
+        .to_csv(stateFile, index=False)
+    return len(rows)
+
+
+def storedSurveysFile(store_dir=STORE_DIR):
+    return os.path.join(store_dir, "surveys.csv")
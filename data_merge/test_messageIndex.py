@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from messageIndex import MessageIndex
+
+
+def mergedDays(n_subs=3, n_days=30, seed=0):
+    '''
+    A small merged dataframe as mergeData writes it: 10 baseline days,
+    then a message a day, with a rating row on some message days
+    '''
+    rng = np.random.RandomState(seed)
+    rows = []
+    for sub in range(1001, 1001 + n_subs):
+        for day, date in enumerate(pd.date_range("2019-09-01", periods=n_days)):
+            messaged = day >= 10
+            row = {'sub': str(sub), 'ActivityDate': date.strftime("%Y-%m-%d"),
+                   'TotalSteps': str(rng.randint(0, 15000)), 'msg_start': str(int(messaged)),
+                   'msg_id': str(rng.randint(1, 6)) if messaged else "NA",
+                   'valence': rng.choice(["pos", "neg"]) if messaged else "NA",
+                   's_ns': rng.choice(["s", "ns"]) if messaged else "NA",
+                   'trial_type': "NA", 'rating': "NA"}
+            rows.append(row)
+            if messaged and rng.rand() < 0.5:
+                rows.append(dict(row, trial_type="rating", rating=str(rng.randint(1, 5))))
+    return pd.DataFrame(rows)
+
+
+def test_split_build_equals_full_build(tmp_path):
+    merged = mergedDays()
+    full = MessageIndex(str(tmp_path / "full.csv"), str(tmp_path / "full_days.csv"))
+    full.update(merged)
+
+    files = (str(tmp_path / "split.csv"), str(tmp_path / "split_days.csv"))
+    for cut in ["2019-09-15", "2019-09-16", "2019-09-22", "2019-09-30"]:
+        split = MessageIndex(*files)
+        split.update(merged.loc[merged['ActivityDate'] <= cut])
+        split.save()
+    split = MessageIndex(*files)
+
+    expected = full.stats.sort_index()
+    assert expected['n_next'].sum() > 0
+    pd.testing.assert_frame_equal(split.stats.sort_index().astype(float), expected.astype(float))
+
+
+def test_update_is_idempotent(tmp_path):
+    merged = mergedDays()
+    index = MessageIndex(str(tmp_path / "index.csv"), str(tmp_path / "days.csv"))
+    assert index.update(merged) > 0
+    before = index.stats.copy()
+    assert index.update(merged) == 0
+    pd.testing.assert_frame_equal(index.stats, before)
@@ -0,0 +1,42 @@
+import os
+
+import pandas as pd
+
+from surveyStore import COLUMNS, ingestSurveys, storedSurveysFile
+
+
+def writeExport(path, records, stamp):
+    '''
+    A REDCap DailySurveys export (with the BOM REDCap writes) holding the given record_ids
+    '''
+    rows = pd.DataFrame({'record_id': records, 'redcap_survey_identifier': "",
+                         'daily_survey_timestamp': ["2019-03-%02d 08:00:00" % (1 + r % 28) for r in records],
+                         'subject_id': [1000 + r % 5 for r in records], 'location': "Home"})
+    for col in ['lap', 'hap', 'han', 'lan', 'la', 'p', 'n', 'ha', 'self_efficacy_daily']:
+        rows[col] = [r % 5 + 1 for r in records]
+    fname = "DailySurveys_DATA_%s.csv" % stamp
+    rows.to_csv(os.path.join(str(path), fname), index=False, encoding='utf-8-sig')
+    return fname
+
+
+def storedRecords(store_dir):
+    return list(pd.read_csv(storedSurveysFile(store_dir))['record_id'])
+
+
+def test_new_records_after_deleted_rows(tmp_path):
+    raw, store = tmp_path / "raw", str(tmp_path / "store")
+    raw.mkdir()
+    path_to_data = str(raw) + os.sep
+
+    first = writeExport(raw, list(range(1, 101)), "2019-04-01_0900")
+    assert ingestSurveys(path_to_data, [first], store) == 100
+
+    # Two old records deleted in REDCap, three new ones added
+    second = writeExport(raw, [r for r in range(1, 101) if r not in (10, 20)] + [101, 102, 103], "2019-04-08_0900")
+    assert ingestSurveys(path_to_data, [first, second], store) == 3
+    assert storedRecords(store) == list(range(1, 104))
+    assert list(pd.read_csv(storedSurveysFile(store)).columns) == COLUMNS
+
+    # Same export again: nothing new
+    assert ingestSurveys(path_to_data, [first, second], store) == 0
+    assert storedRecords(store) == list(range(1, 104))
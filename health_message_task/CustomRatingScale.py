@@ -27,6 +27,122 @@ from psychopy.tools.attributetools import logAttrib
 from psychopy.constants import FINISHED, STARTED, NOT_STARTED
 
 
+class RatingHistory(object):
+    """A compact (rating, RT) history backed by preallocated numpy arrays.
+
+    Behaves like the list of ``(rating, RT)`` tuples that RatingScale
+    keeps: ``len()``, indexing (``history[-1]``), slicing, iteration and
+    ``append((rating, rt))`` all work as before, but entries are stored
+    in two arrays, so recording a sample does not allocate a tuple.
+    Use ``add(rating, rt)`` to record without building a tuple at all,
+    and ``ratings`` / ``times`` to get the arrays in order.
+
+    If ``maxlen`` is given, the history is a ring buffer holding only the
+    most recent ``maxlen`` entries (e.g., for a rating sampled every
+    frame); otherwise it grows as needed.
+
+    Numeric ratings are stored as floats (``None`` as NaN) and read back
+    as ints when ``integer=True`` and the value is whole; categorical
+    ratings (choices) use an object array.
+    """
+
+    def __init__(self, maxlen=None, categorical=False, integer=False,
+                 capacity=64):
+        self.maxlen = maxlen
+        self.integer = integer
+        if maxlen:
+            capacity = maxlen
+        self._ratings = numpy.empty(capacity,
+                                    object if categorical else float)
+        self._times = numpy.empty(capacity, float)
+        self._start = 0  # index of the oldest entry (ring buffer)
+        self._count = 0
+
+    def add(self, rating, rt):
+        capacity = len(self._times)
+        if self._count == capacity:
+            if self.maxlen:
+                # overwrite the oldest entry
+                self._start = (self._start + 1) % capacity
+                self._count -= 1
+            else:
+                self._ratings = numpy.concatenate(
+                    (self._ratings, numpy.empty_like(self._ratings)))
+                self._times = numpy.concatenate(
+                    (self._times, numpy.empty_like(self._times)))
+                capacity *= 2
+        i = (self._start + self._count) % capacity
+        if rating is None and self._ratings.dtype != object:
+            rating = numpy.nan
+        self._ratings[i] = rating
+        self._times[i] = numpy.nan if rt is None else rt
+        self._count += 1
+
+    def append(self, entry):
+        self.add(entry[0], entry[1])
+
+    def _read(self, value):
+        if self._ratings.dtype == object:
+            return value
+        if numpy.isnan(value):
+            return None
+        value = float(value)
+        if self.integer and value.is_integer():
+            return int(value)
+        return value
+
+    def _index(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError('RatingHistory index out of range')
+        return (self._start + i) % len(self._times)
+
+    def lastRating(self):
+        """The most recent rating (same as ``history[-1][0]``)."""
+        return self._read(self._ratings[self._index(-1)])
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._count))]
+        j = self._index(i)
+        rt = self._times[j]
+        return (self._read(self._ratings[j]),
+                None if numpy.isnan(rt) else float(rt))
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def _ordered(self, values):
+        if self._start + self._count <= len(values):
+            return values[self._start:self._start + self._count]  # a view
+        order = (self._start + numpy.arange(self._count)) % len(values)
+        return values[order]
+
+    @property
+    def ratings(self):
+        """Ratings in order, as an array (a view unless the ring wrapped)."""
+        return self._ordered(self._ratings)
+
+    @property
+    def times(self):
+        """RTs in order, as an array (a view unless the ring wrapped)."""
+        return self._ordered(self._times)
+
+
 class CustomRatingScale(MinimalStim):
     """A class for obtaining ratings, e.g., on a 1-to-7 or categorical scale.
 
@@ -142,6 +258,8 @@ class CustomRatingScale(MinimalStim):
                  depth=0,
                  name=None,
                  autoLog=True,
+                 keyboard=None,
+                 historyLength=None,
                  **kwargs):  # catch obsolete args
         """
     :Parameters:
@@ -281,6 +399,19 @@ class CustomRatingScale(MinimalStim):
         flipVert :
             Whether to mirror-reverse the rating scale in the vertical
             direction.
+        keyboard :
+            Optional :class:`~psychopy.hardware.keyboard.Keyboard` used to
+            read key responses instead of ``event.getKeys``. Its key presses
+            are timestamped by the device (not when ``draw()`` runs), and
+            those times are used in the history and as the decision time.
+            Its clock is reset, and earlier presses of the scale's keys
+            discarded, on the first ``draw()`` (other keys, e.g. scanner
+            triggers, are left in the shared buffer).
+            Default = ``None`` (frame-quantized ``event`` keys).
+        historyLength :
+            Keep only the most recent ``historyLength`` (rating, RT) pairs in
+            the history (a ring buffer), e.g., for ratings sampled on every
+            frame. Default = ``None`` (keep all).
     """
         # what local vars are defined (these are the init params) for use by
         # __repr__
@@ -309,6 +440,8 @@ class CustomRatingScale(MinimalStim):
 
         self.autoLog = False  # needs to start off False
         self.win = win
+        self.keyboard = keyboard
+        self.historyLength = historyLength
         self.disappear = disappear
 
         # internally work in norm units, restore to orig units at the end of
@@ -1056,11 +1189,18 @@ class CustomRatingScale(MinimalStim):
 
     # autoDraw and setAutoDraw are inherited from basevisual.MinimalStim
 
-    def acceptResponse(self, triggeringAction, log=True):
+    def acceptResponse(self, triggeringAction, log=True, rt=None):
         """Commit and optionally log a response and the action.
+
+        `rt` is the time of the triggering action, if known (e.g., a
+        timestamped key press); otherwise the current time is used.
         """
         self.noResponse = False
-        self.history.append((self.getRating(), self.getRT()))
+        if rt is None:
+            rt = self.getRT()
+        else:
+            self.keyDecisionTime = rt
+        self.history.add(self.getRating(), rt)
         if log and self.autoLog:
             vals = (self.name, triggeringAction, str(self.getRating()))
             logging.data('RatingScale %s: (%s) rating=%s' % vals)
@@ -1100,6 +1240,10 @@ class CustomRatingScale(MinimalStim):
         if self.firstDraw:
             self.firstDraw = False
             self.clock.reset()
+            if self.keyboard is not None:
+                self.keyboard.clock.reset()
+                # only this scale's keys: the device buffer is shared
+                self.keyboard.getKeys(keyList=self.allKeys, waitRelease=False)
             self.status = STARTED
             if self.markerStart:
                 # has been converted in index if given as str
@@ -1112,7 +1256,12 @@ class CustomRatingScale(MinimalStim):
                     first = self.choices[int(self.markerStart)]
             else:
                 first = None
-            self.history = [(first, 0.0)]  # this will grow
+            # this will grow (up to historyLength entries, if given)
+            self.history = RatingHistory(
+                maxlen=self.historyLength,
+                categorical=bool(self.choices),
+                integer=(self.precision == 1))
+            self.history.add(first, 0.0)
             self.beyondMinTime = False  # has minTime elapsed?
             self.timedOut = False
 
@@ -1204,11 +1353,22 @@ class CustomRatingScale(MinimalStim):
 
         # handle key responses:
         if not self.mouseOnly:
-            for key in event.getKeys(self.allKeys):
+            if self.keyboard is not None:
+                # device timestamps, relative to the first draw()
+                keyPresses = [(k.name, round(k.rt, 3)) for k in
+                              self.keyboard.getKeys(keyList=self.allKeys,
+                                                    waitRelease=False)]
+            else:
+                keyPresses = [(k, None) for k in event.getKeys(self.allKeys)]
+            for key, keyTime in keyPresses:
                 if key in self.skipKeys:
                     self.markerPlacedAt = None
                     self.noResponse = False
-                    self.history.append((None, self.getRT()))
+                    if keyTime is None:
+                        keyTime = self.getRT()
+                    else:
+                        self.keyDecisionTime = keyTime
+                    self.history.add(None, keyTime)
                 elif key in self.respKeys and self.enableRespKeys:
                     # place the marker at the corresponding tick (from key)
                     self.markerPlaced = True
@@ -1237,7 +1397,8 @@ class CustomRatingScale(MinimalStim):
                         self.markerPlacedAt = self.markerPlacedAt + rightIncr
                         self.markerPlacedBySubject = True
                     elif key in self.acceptKeys:
-                        self.acceptResponse('key response', log=log)
+                        self.acceptResponse('key response', log=log,
+                                            rt=keyTime)
                     # off the end?
                     self.markerPlacedAt = max(0, self.markerPlacedAt)
                     self.markerPlacedAt = min(
@@ -1246,7 +1407,14 @@ class CustomRatingScale(MinimalStim):
                 if (self.markerPlacedBySubject and self.singleClick
                         and self.beyondMinTime):
                     self.marker.setPos((0, self.offsetVert), '+', log=False)
-                    self.acceptResponse('key single-click', log=log)
+                    self.acceptResponse('key single-click', log=log,
+                                        rt=keyTime)
+                elif (keyTime is not None and self.noResponse and
+                        self.markerPlacedBySubject and
+                        self.history.lastRating() != self.getRating()):
+                    # record each timestamped key press, even if several
+                    # arrive between two draws
+                    self.history.add(self.getRating(), keyTime)
 
         # handle mouse left-click:
         if not self.noMouse and self.myMouse.getPressed()[0]:
@@ -1286,7 +1454,10 @@ class CustomRatingScale(MinimalStim):
 
         # decision time = sec from first .draw() to when first 'accept' value:
         if not self.noResponse and self.decisionTime == 0:
-            self.decisionTime = self.clock.getTime()
+            if self.keyDecisionTime is not None:
+                self.decisionTime = self.keyDecisionTime
+            else:
+                self.decisionTime = self.clock.getTime()
             if log and self.autoLog:
                 logging.data('RatingScale %s: rating RT=%.3f' %
                              (self.name, self.decisionTime))
@@ -1300,9 +1471,9 @@ class CustomRatingScale(MinimalStim):
         else:
             # build up response history if no decision or skip yet:
             tmpRating = self.getRating()
-            if (self.history[-1][0] != tmpRating and
+            if (self.history.lastRating() != tmpRating and
                     self.markerPlacedBySubject):
-                self.history.append((tmpRating, self.getRT()))  # tuple
+                self.history.add(tmpRating, self.getRT())
 
         # restore user's units:
         self.win.setUnits(self.savedWinUnits, log=False)
@@ -1339,6 +1510,7 @@ class CustomRatingScale(MinimalStim):
         self.wasNearLine = False
         self.firstDraw = True  # -> self.clock.reset() at start of draw()
         self.decisionTime = 0
+        self.keyDecisionTime = None  # set by timestamped key responses
         self.markerPosFixed = False
         self.frame = 0  # a counter used only to 'pulse' the 'accept' box
 
@@ -1398,10 +1570,14 @@ class CustomRatingScale(MinimalStim):
         return round(self.decisionTime, 3)
 
     def getHistory(self):
-        """Return a list of the subject's history as (rating, time) tuples.
+        """Return the subject's history as (rating, time) tuples.
 
         The history can be retrieved at any time, allowing for continuous
         ratings to be obtained in real-time. Both numerical and categorical
         choices are stored automatically in the history.
+
+        The history is a :class:`RatingHistory`, which indexes and iterates
+        like a list of tuples; its ``ratings`` and ``times`` attributes give
+        the same data as arrays.
         """
         return self.history
@@ -0,0 +1,88 @@
+from __future__ import absolute_import, division, print_function
+
+import atexit
+import csv
+import os
+import threading
+
+try:
+    from queue import Queue
+except ImportError:  ## Python 2
+    from Queue import Queue
+
+
+class EventLogWriter(object):
+    '''
+    Writes rows of the task's events TSV on a background thread,
+    so that disk writes and flushes never happen between two flips.
+
+    Rows are queued by writerow() and written in order; the file is
+    flushed whenever the queue runs empty, so rows reach the OS soon
+    after they are logged. close() drains the queue, then fsyncs and
+    closes the file. It is registered with atexit, so the queue is
+    also drained when core.quit() is called (e.g. after ESCAPE).
+
+    If a write fails (e.g. disk full), the thread stops and the error
+    is raised again by the next writerow() and by close(), so a lost
+    log is never mistaken for a saved one.
+    '''
+
+    def __init__(self, filename, header, delimiter='\t'):
+        self.filename = filename
+        self.closed = False
+        self._error = None  ## Exception that stopped the writer thread
+        self._queue = Queue()
+        self._file = open(filename, 'w')
+        self._writer = csv.writer(self._file, delimiter=delimiter)
+
+        ## Header is written synchronously, before anything is on screen
+        self._writer.writerow(header)
+        self._file.flush()
+
+        self._thread = threading.Thread(target=self._writeLoop, name='EventLogWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    def writerow(self, row):
+        '''
+        Queues one row; a copy is taken, so the caller
+        can keep re-using (and changing) the same list
+        '''
+        if self._error is not None:
+            raise self._error
+        if self.closed:
+            raise ValueError("EventLogWriter for %s is already closed" % self.filename)
+        self._queue.put(list(row))
+
+    def _writeLoop(self):
+        try:
+            while True:
+                row = self._queue.get()
+                if row is None:  ## Sentinel from close()
+                    break
+                self._writer.writerow(row)
+                if self._queue.empty():
+                    self._file.flush()
+
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except Exception as e:
+            self._error = e
+        finally:
+            self._file.close()
+
+    def close(self):
+        '''
+        Writes any queued rows, then fsyncs and closes the file;
+        blocks until done, and raises the error if a write failed.
+        Safe to call more than once
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,148 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import threading
+import time
+import wave
+from collections import OrderedDict
+
+import numpy
+
+try:
+    from queue import Queue
+except ImportError:  ## Python 2
+    from Queue import Queue
+
+
+class MediaPrefetcher(object):
+    '''
+    Decodes the pictogram and audio for upcoming trials on a
+    background thread, so that nothing is read from disk or
+    decoded at message onset.
+
+    Media are keyed by message id (e.g. 'pos_soc_419'):
+        images/pos_soc_419.png   ->  RGB PIL image
+        audio/pos_soc_419.wav    ->  (float samples in [-1, 1], sample rate)
+    A missing file gives None, and so does one that fails to decode
+    (e.g. a corrupt PNG or 24-bit audio); the errors are kept in the
+    media's 'errors' list, so the worker never stops on a bad file.
+    Decoded media are kept in a cache of at most max_items messages;
+    the least recently used are dropped. load() decodes a message on
+    the calling thread, e.g. when get() times out.
+
+    Textures and sound buffers still have to be made on the main
+    thread (OpenGL/audio contexts are not shared with the worker);
+    do that during fixation with ImageStim.setImage() and
+    sound.Sound(value=samples, sampleRate=rate).
+    '''
+
+    def __init__(self, image_dir='images', audio_dir='audio', max_items=6):
+        self.image_dir = image_dir
+        self.audio_dir = audio_dir
+        self.max_items = max_items
+
+        self._cache = OrderedDict()  ## key -> {'image': ..., 'audio': ...}
+        self._pending = set()
+        self._lock = threading.Condition()
+        self._queue = Queue()
+
+        self._thread = threading.Thread(target=self._decodeLoop, name='MediaPrefetcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def prefetch(self, keys):
+        '''
+        Queues decoding of each key that is not already cached or queued
+        '''
+        with self._lock:
+            for key in keys:
+                if key in self._cache or key in self._pending:
+                    continue
+                self._pending.add(key)
+                self._queue.put(key)
+
+    def get(self, key, timeout=None):
+        '''
+        Returns the decoded media for key, waiting for the worker if
+        needed (it is queued now if it was never prefetched). Raises
+        RuntimeError if it is not ready within timeout seconds
+        '''
+        self.prefetch([key])
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with self._lock:
+            while key not in self._cache:
+                remaining = None
+                if timeout is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise RuntimeError("Media for %s not decoded within %s sec" % (key, timeout))
+                self._lock.wait(remaining)
+
+            media = self._cache.pop(key)
+            self._cache[key] = media  ## Now the most recently used
+            return media
+
+    def _decodeLoop(self):
+        while True:
+            key = self._queue.get()
+            if key is None:  ## Sentinel from close()
+                break
+            media = self.load(key)
+            with self._lock:
+                self._pending.discard(key)
+                self._cache[key] = media
+                while len(self._cache) > self.max_items:
+                    self._cache.popitem(last=False)
+                self._lock.notify_all()
+
+    def load(self, key):
+        '''
+        Decodes the media for key on this thread: {'image', 'audio',
+        'errors'}, with None for any file that could not be decoded
+        '''
+        media = {'errors': []}
+        for kind, loader in [('image', self.loadImage), ('audio', self.loadAudio)]:
+            try:
+                media[kind] = loader(key)
+            except Exception as e:
+                media[kind] = None
+                media['errors'].append(e)
+        return media
+
+    def loadImage(self, key):
+        path = os.path.join(self.image_dir, "%s.png" % key)
+        if not os.path.exists(path):
+            return None
+        from PIL import Image
+        image = Image.open(path)
+        return image.convert('RGB')  ## Forces the full decode here
+
+    def loadAudio(self, key):
+        path = os.path.join(self.audio_dir, "%s.wav" % key)
+        if not os.path.exists(path):
+            return None
+        wavFile = wave.open(path, 'rb')
+        try:
+            rate = wavFile.getframerate()
+            nChannels = wavFile.getnchannels()
+            width = wavFile.getsampwidth()
+            frames = wavFile.readframes(wavFile.getnframes())
+        finally:
+            wavFile.close()
+
+        if width == 1:  ## 8-bit wav is unsigned
+            samples = (numpy.frombuffer(frames, dtype=numpy.uint8).astype(numpy.float32) - 128) / 128.0
+        else:
+            if width not in (2, 4):
+                raise ValueError("%s: %d-bit audio is not supported (use 8, 16 or 32-bit)" % (path, 8 * width))
+            dtype = {2: numpy.int16, 4: numpy.int32}[width]
+            samples = numpy.frombuffer(frames, dtype=dtype).astype(numpy.float32) / float(numpy.iinfo(dtype).max)
+        if nChannels > 1:
+            samples = samples.reshape(-1, nChannels)
+        return samples, rate
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
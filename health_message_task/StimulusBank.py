@@ -0,0 +1,91 @@
+from __future__ import absolute_import, division, print_function
+
+import csv
+import math
+
+
+class StimulusBank(object):
+    '''
+    Loads and validates the stimulus files for all runs once,
+    before the session starts, and lays out every message's text
+    ahead of time so no TextStim.setText() happens during a run.
+
+    Each stimulus file (stimuli_01.csv, stimuli_02.csv, ...) has columns
+    valence, s_ns, id, message. Rows are returned by getRuns() as
+    dictionaries with the same keys, plus 'msg_id' (e.g. 'pos_soc_419',
+    as written to the events TSV); messages have their quotes stripped.
+    '''
+
+    valences = ('positive', 'negative')
+    socialTypes = ('social', 'nonsocial')
+
+    def __init__(self, run_numbers, wrap_width=20, text_height=1.25, max_lines=10, char_width=0.5):
+        ## char_width: approximate width of one character, relative to text height
+        self.runs = {}
+        self.messageStims = {}
+
+        for run_number in run_numbers:
+            self.runs[run_number] = self.loadRun(run_number)
+
+        self.validate(wrap_width, text_height, max_lines, char_width)
+
+    def loadRun(self, run_number):
+        stimFile = "stimuli_%s.csv" % (run_number)
+        with open(stimFile) as f:
+            stimuli = [row for row in csv.DictReader(f)]
+
+        for stim in stimuli:
+            stim['message'] = stim['message'].strip('"')
+            stim['msg_id'] = stim['valence'][0:3] + "_" + stim['s_ns'][:-3] + "_" + stim['id']
+
+        return stimuli
+
+    def validate(self, wrap_width, text_height, max_lines, char_width):
+        '''
+        Raises ValueError listing every problem found in the loaded stimuli:
+        unknown valence or s_ns, missing or duplicate ids (across all runs),
+        empty messages, or messages too long to fit in max_lines at wrap_width
+        '''
+        problems = []
+        seenIds = {}
+        charsPerLine = int(wrap_width / (char_width * text_height))
+
+        for run_number in sorted(self.runs):
+            for row, stim in enumerate(self.runs[run_number]):
+                where = "stimuli_%s.csv row %d" % (run_number, row + 2)  ## +2 for header and 1-indexing
+                if stim['valence'] not in self.valences:
+                    problems.append("%s: unknown valence '%s'" % (where, stim['valence']))
+                if stim['s_ns'] not in self.socialTypes:
+                    problems.append("%s: unknown s_ns '%s'" % (where, stim['s_ns']))
+                if not stim['id']:
+                    problems.append("%s: missing id" % where)
+                elif stim['msg_id'] in seenIds:
+                    problems.append("%s: id %s already used in %s" % (where, stim['msg_id'], seenIds[stim['msg_id']]))
+                else:
+                    seenIds[stim['msg_id']] = where
+                if not stim['message'].strip():
+                    problems.append("%s: empty message" % where)
+                elif math.ceil(len(stim['message']) / charsPerLine) > max_lines:
+                    problems.append("%s: message of %d characters needs more than %d lines" % (where, len(stim['message']), max_lines))
+
+        if problems:
+            raise ValueError("Invalid stimulus files:\n    " + "\n    ".join(problems))
+
+    def getRuns(self, run_number):
+        '''
+        Returns a copy of the run's stimuli (list of dictionaries),
+        suitable for setting up a TrialHandler
+        '''
+        return [dict(stim) for stim in self.runs[run_number]]
+
+    def prepareText(self, makeStim):
+        '''
+        Creates one text stimulus per message using makeStim(text),
+        so that glyph layout happens now rather than at message onset
+        '''
+        for run_number in self.runs:
+            for stim in self.runs[run_number]:
+                self.messageStims[stim['msg_id']] = makeStim(stim['message'])
+
+    def getMessageStim(self, trial):
+        return self.messageStims[trial['msg_id']]
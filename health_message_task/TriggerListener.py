@@ -0,0 +1,138 @@
+from __future__ import absolute_import, division, print_function
+
+import csv
+import threading
+import time
+
+import numpy
+
+
+## PsychoPy's device keyboards share one process-wide key buffer, which is
+## not safe to read from two threads at once; every reader takes this lock
+KEYBOARD_LOCK = threading.Lock()
+
+
+class SharedKeyboard(object):
+    '''
+    A psychopy.hardware.keyboard.Keyboard whose getKeys() and
+    clearEvents() hold KEYBOARD_LOCK, so the trigger listener's thread
+    and the main thread (e.g. a rating scale) can both read keys;
+    everything else (e.g. clock) is the wrapped keyboard's
+    '''
+
+    def __init__(self, keyboard, lock=KEYBOARD_LOCK):
+        self._keyboard = keyboard
+        self._lock = lock
+
+    def getKeys(self, *args, **kwargs):
+        with self._lock:
+            return self._keyboard.getKeys(*args, **kwargs)
+
+    def clearEvents(self, *args, **kwargs):
+        with self._lock:
+            return self._keyboard.clearEvents(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._keyboard, name)
+
+
+class TriggerListener(object):
+    '''
+    Timestamps every scanner trigger (TR pulse, sent as the 't' key)
+    during a run on a background thread, and maps between the
+    stimulus PC's clock and scanner time.
+
+    Key presses are read from a psychopy.hardware.keyboard.Keyboard,
+    which timestamps them at the device, so the polling thread's own
+    timing does not matter. Create the listener before waiting for the
+    first trigger, and call start(clock) right after the run clock is
+    reset on it; that trigger is volume 0 at time 0, and pulse times
+    are put on the run clock. Only the trigger key is read from the
+    keyboard's buffer, which other Keyboards share; wrap every Keyboard
+    in the process in a SharedKeyboard so they never read it at once.
+
+    Scanner time is volume number * TR. Volume numbers come from the
+    time since the first trigger, so a missed pulse does not shift the
+    count. toScanTime()/toClockTime() use a least-squares line through
+    all triggers so far, which absorbs drift between the two clocks.
+    '''
+
+    def __init__(self, keyboard, tr, key='t', poll_interval=0.001):
+        self.keyboard = keyboard
+        self.tr = tr
+        self.key = key
+        self.poll_interval = poll_interval
+
+        self.triggerTimes = []  ## Clock time of each pulse, in order
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._fit = (0.0, 1.0)  ## scan time = a + b * clock time
+        self._offset = 0.0  ## keyboard clock - run clock
+
+    def start(self, clock):
+        self._offset = self.keyboard.clock.getTime() - clock.getTime()
+        self.keyboard.getKeys(keyList=[self.key], waitRelease=False)  ## The first trigger (time 0)
+        with self._lock:
+            self.triggerTimes = [0.0]
+        self._running = True
+        self._thread = threading.Thread(target=self._listen, name='TriggerListener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _listen(self):
+        while self._running:
+            keys = self.keyboard.getKeys(keyList=[self.key], waitRelease=False)
+            if keys:
+                with self._lock:
+                    self.triggerTimes.extend(k.rt - self._offset for k in keys)
+                    self._updateFit()
+            time.sleep(self.poll_interval)
+
+    def _updateFit(self):
+        ## Called with the lock held
+        times = numpy.array(self.triggerTimes)
+        volumes = numpy.round(times / self.tr)
+        if len(numpy.unique(volumes)) < 2:
+            return
+        b, a = numpy.polyfit(times, volumes * self.tr, 1)
+        self._fit = (a, b)
+
+    def volumes(self):
+        '''
+        Returns (clock times, volume numbers) of the triggers so far
+        '''
+        with self._lock:
+            times = numpy.array(self.triggerTimes)
+        return times, numpy.round(times / self.tr).astype(int)
+
+    def toScanTime(self, clock_time):
+        '''
+        Converts a run-clock time to scanner time (seconds since volume 0, in TRs * TR)
+        '''
+        a, b = self._fit
+        return a + b * clock_time
+
+    def toClockTime(self, scan_time):
+        '''
+        Converts a scanner time to the run clock, e.g. to put a planned onset on the TR grid
+        '''
+        a, b = self._fit
+        return (scan_time - a) / b
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def writeSidecar(self, filename):
+        '''
+        Writes one row per trigger: volume number, measured onset on
+        the run clock, the onset expected from the TR, and the difference
+        '''
+        times, volumes = self.volumes()
+        with open(filename, 'w') as f:
+            writer = csv.writer(f, delimiter='\t')
+            writer.writerow(['volume', 'onset', 'expected_onset', 'drift'])
+            for t, v in zip(times, volumes):
+                writer.writerow([v, t, v * self.tr, t - v * self.tr])
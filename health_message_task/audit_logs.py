@@ -0,0 +1,130 @@
+'''
+Timing and completeness audit for message task logs
+(sub-XXX_task-HealthMessage*_run-XX_events.tsv).
+
+Loads every log at once, rebuilds each run's timeline and reports one
+row per run: trials completed, truncation, onset drift against the
+nominal durations (or against planned_onset, for logs that have it),
+gaps/overlaps between consecutive events, and response-time summaries.
+
+Usage (from this directory):
+    python audit_logs.py                       ## audits logs/
+    python audit_logs.py logs ../data_merge/data_raw --out audit.csv
+'''
+
+import argparse
+import glob
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+
+## As in getDurations() in message_task_scale.py
+NOMINAL = {'message': 8, 'rating': 5, 'stabilize': 10}
+TRIALS_PER_RUN = 40
+
+LOG_PATTERN = re.compile(r'sub-(?P<sub>[^_]+)_task-[^_]+_run-(?P<run>\d+)_events\.tsv$')
+
+
+def loadLogs(log_dirs):
+    '''
+    Reads every events TSV in log_dirs into one dataframe
+    with 'file', 'sub' and 'run' columns added;
+    empty logs are kept as a single row with no events
+    '''
+    frames = []
+    for log_dir in log_dirs:
+        for path in sorted(glob.glob(os.path.join(log_dir, 'sub-*_events.tsv'))):
+            match = LOG_PATTERN.search(os.path.basename(path))
+            if match is None:
+                continue
+            log = pd.read_csv(path, sep='\t', dtype=str)
+            if log.empty:
+                log = pd.DataFrame({'onset': [np.nan]})
+            log['file'] = path
+            log['sub'] = match.group('sub')
+            log['run'] = match.group('run')
+            frames.append(log)
+
+    logs = pd.concat(frames, ignore_index=True, sort=False)
+
+    # Repeated header lines (e.g. from a restarted run) become NaN and are dropped below
+    for col in ['onset', 'duration', 'trial', 'resp_time', 'planned_onset']:
+        if col in logs.columns:
+            logs[col] = pd.to_numeric(logs[col], errors='coerce')
+    if 'planned_onset' not in logs.columns:
+        logs['planned_onset'] = np.nan
+
+    return logs
+
+
+def auditLogs(logs, trials_per_run=TRIALS_PER_RUN, nominal=NOMINAL, tolerance=0.05):
+    '''
+    Takes the output of loadLogs() and returns the per-run quality table;
+    gaps and overlaps smaller than tolerance seconds are not counted
+    '''
+    runKeys = ['file', 'sub', 'run']
+    runs = logs[runKeys].drop_duplicates().set_index(runKeys)
+
+    events = logs.dropna(subset=['onset']).sort_values(runKeys + ['onset']).copy()
+    byRun = events.groupby(runKeys, sort=False)
+
+    # Nominal timeline: each event starts when the previous one ends, from the end of stabilization
+    prevDurations = byRun['duration'].cumsum() - events['duration']
+    events['nominal_onset'] = nominal['stabilize'] + prevDurations
+    events['expected_onset'] = events['planned_onset'].fillna(events['nominal_onset'])
+    events['drift'] = events['onset'] - events['expected_onset']
+    events['abs_drift'] = events['drift'].abs()
+
+    # Gap (positive) or overlap (negative) between an event's end and the next onset
+    events['gap'] = byRun['onset'].shift(-1) - (events['onset'] + events['duration'])
+    events['is_gap'] = events['gap'] > tolerance
+    events['is_overlap'] = events['gap'] < -tolerance
+
+    isRating = events['trial_type'] == 'rating'
+    events['rt'] = events['resp_time'].where(isRating)
+    events['no_response'] = (events['rt'] <= 0) | events['rt'].isna()
+    events['no_response'] = events['no_response'].where(isRating)
+    events['nonstandard'] = (((events['trial_type'] == 'message') & (events['duration'] != nominal['message'])) |
+                             (isRating & (events['duration'] != nominal['rating'])))
+
+    byRun = events.groupby(runKeys, sort=False)
+    phasesPerTrial = events.groupby(runKeys + ['trial'])['trial_type'].nunique()
+
+    table = runs.join(byRun.agg(n_events=('onset', 'size'),
+                                n_trials=('trial', 'nunique'),
+                                last_onset=('onset', 'max'),
+                                final_drift=('drift', 'last'),
+                                max_abs_drift=('abs_drift', 'max'),
+                                n_gaps=('is_gap', 'sum'),
+                                n_overlaps=('is_overlap', 'sum'),
+                                max_gap=('gap', 'max'),
+                                min_gap=('gap', 'min'),
+                                rt_median=('rt', 'median'),
+                                rt_iqr=('rt', lambda rt: rt.quantile(0.75) - rt.quantile(0.25)),
+                                no_response_rate=('no_response', 'mean'),
+                                nonstandard_timing=('nonstandard', 'any')))
+    table['incomplete_trials'] = (phasesPerTrial < 3).groupby(level=runKeys).sum()
+
+    for col in ['n_events', 'n_trials', 'n_gaps', 'n_overlaps', 'incomplete_trials']:
+        table[col] = table[col].fillna(0).astype(int)
+    table['truncated'] = (table['n_trials'] < trials_per_run) | (table['incomplete_trials'] > 0)
+
+    return table.reset_index()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Audit message task event logs")
+    parser.add_argument('log_dirs', nargs='*', default=['logs'])
+    parser.add_argument('--trials', type=int, default=TRIALS_PER_RUN, help="trials expected per run")
+    parser.add_argument('--out', help="also write the table to this CSV file")
+    args = parser.parse_args()
+
+    table = auditLogs(loadLogs(args.log_dirs), trials_per_run=args.trials)
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(table.drop(columns=['file']).to_string(index=False, float_format=lambda x: '%.3f' % x))
+    if args.out:
+        table.to_csv(args.out, index=False)
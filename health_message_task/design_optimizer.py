@@ -0,0 +1,208 @@
+from __future__ import absolute_import, division, print_function
+
+#------------------------------------------------------------
+# DESIGN OPTIMIZER - ITI and trial order for the message task
+#------------------------------------------------------------
+## Searches over trial orders and ITI sequences for the design with
+## the best fMRI efficiency for the valence x social contrasts, and
+## writes one schedule per subject and run, e.g.
+##    designs/sub-1017_run-01_design.tsv
+## which do_run uses (in place of a random order and getFixations())
+## when it exists.
+##
+## Usage (from this directory):
+##    python design_optimizer.py 1017 1018 --runs 01 02
+##
+## The search for a subject/run is seeded from the subject ID and run
+## number, so re-running gives the same schedule.
+
+import argparse
+import csv
+import math
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from StimulusBank import StimulusBank
+
+
+## As in getDurations() in message_task_scale.py
+DURATIONS = {'message': 8, 'rating': 5, 'stabilize': 10}
+
+## Uniform ITIs between 2 and 6 sec, 8 of each (160 sec per run)
+ITI_POOL = [2, 3, 4, 5, 6] * 8
+
+## Design matrix columns: one message regressor per condition, then rating and intercept
+CONDITIONS = [('positive', 'social'), ('positive', 'nonsocial'), ('negative', 'social'), ('negative', 'nonsocial')]
+CONTRASTS = np.array([[1, 1, -1, -1, 0, 0],   ## valence
+                      [1, -1, 1, -1, 0, 0],   ## social
+                      [1, -1, -1, 1, 0, 0]],  ## valence x social
+                     dtype=float)
+
+
+def spmHRF(dt, length=32.0):
+    '''
+    Canonical double-gamma HRF (SPM defaults: peak 6 s,
+    undershoot 16 s, ratio 1/6) sampled every dt seconds
+    '''
+    t = np.arange(0, length, dt)
+
+    def gammaPdf(shape):
+        return np.exp((shape - 1) * np.log(np.maximum(t, 1e-12)) - t - math.lgamma(shape))
+
+    hrf = gammaPdf(6) - gammaPdf(16) / 6.0
+    return hrf / hrf.sum()
+
+
+def integratedHRF(dt=0.05, length=32.0):
+    '''
+    Returns (times, cumulative HRF); the response at time t to a boxcar
+    from on to off is H(t - on) - H(t - off)
+    '''
+    hrf = spmHRF(dt, length)
+    times = np.arange(len(hrf) + 1) * dt
+    return times, np.concatenate([[0.0], np.cumsum(hrf)])
+
+
+def conditionIndex(stimuli):
+    '''
+    Condition number (index into CONDITIONS) for each stimulus
+    '''
+    return np.array([CONDITIONS.index((stim['valence'], stim['s_ns'])) for stim in stimuli])
+
+
+def designEfficiency(orders, itis, conditions, tr=2.0, durations=DURATIONS, hrf=None):
+    '''
+    Efficiency of a batch of candidate designs, all at once.
+
+    orders: (n_candidates, n_trials) stimulus index shown on each trial
+    itis: (n_candidates, n_trials) ITI before each trial's message
+    conditions: condition number of each stimulus
+    Returns (n_candidates,) efficiencies 1 / trace(C (X'X)^-1 C')
+    '''
+    if hrf is None:
+        hrf = integratedHRF()
+    hrfTimes, hrfCum = hrf
+
+    nCand, nTrials = orders.shape
+    trialLength = durations['message'] + durations['rating']
+
+    ## Onsets of each trial's message and rating
+    itiOnsets = durations['stabilize'] + np.cumsum(itis + trialLength, axis=1) - (itis + trialLength)
+    msgOnsets = itiOnsets + itis
+    ratingOnsets = msgOnsets + durations['message']
+
+    runLength = itiOnsets[:, -1].max() + itis.max() + trialLength
+    scanTimes = np.arange(0, runLength, tr)
+
+    def boxcarResponse(onsets, duration):
+        ## (n_candidates, n_trials, n_scans) HRF response to each event
+        lag = scanTimes[None, None, :] - onsets[:, :, None]
+        return np.interp(lag, hrfTimes, hrfCum, left=0.0) - np.interp(lag - duration, hrfTimes, hrfCum, left=0.0)
+
+    oneHot = np.eye(len(CONDITIONS))[np.asarray(conditions)[orders]]  ## (n_candidates, n_trials, n_conditions)
+    msgRegressors = np.einsum('ctk,cts->csk', oneHot, boxcarResponse(msgOnsets, durations['message']))
+    ratingRegressor = boxcarResponse(ratingOnsets, durations['rating']).sum(axis=1)
+
+    X = np.concatenate([msgRegressors, ratingRegressor[:, :, None], np.ones((nCand, len(scanTimes), 1))], axis=2)
+    XtXinv = np.linalg.pinv(np.einsum('csi,csj->cij', X, X))
+    variances = np.einsum('ki,cij,kj->c', CONTRASTS, XtXinv, CONTRASTS)
+
+    return 1.0 / variances
+
+
+def _searchChunk(args):
+    '''
+    One worker's share of the search; returns its best (efficiency, order, itis)
+    '''
+    seed, conditions, n_candidates, batch_size, tr = args
+    rng = np.random.default_rng(seed)
+    hrf = integratedHRF()
+    nTrials = len(conditions)
+    pool = np.resize(ITI_POOL, nTrials)
+
+    best = (-np.inf, None, None)
+    for start in range(0, n_candidates, batch_size):
+        n = min(batch_size, n_candidates - start)
+        orders = np.argsort(rng.random((n, nTrials)), axis=1)
+        itis = pool[np.argsort(rng.random((n, nTrials)), axis=1)]
+        eff = designEfficiency(orders, itis, conditions, tr=tr, hrf=hrf)
+        i = int(np.argmax(eff))
+        if eff[i] > best[0]:
+            best = (float(eff[i]), orders[i], itis[i])
+
+    return best
+
+
+def optimizeDesign(stimuli, seed, n_candidates=20000, n_workers=4, batch_size=250, tr=2.0):
+    '''
+    Searches n_candidates random orders/ITI sequences for the stimuli
+    (split across n_workers processes) and returns the best as
+    (efficiency, stimuli in presentation order, ITIs)
+    '''
+    conditions = conditionIndex(stimuli)
+    seeds = np.random.SeedSequence(seed).spawn(n_workers)
+    perWorker = int(math.ceil(n_candidates / n_workers))
+    jobs = [(s, conditions, perWorker, batch_size, tr) for s in seeds]
+
+    if n_workers > 1:
+        workers = Pool(n_workers)
+        try:
+            results = workers.map(_searchChunk, jobs)
+        finally:
+            workers.close()
+    else:
+        results = [_searchChunk(job) for job in jobs]
+
+    efficiency, order, itis = max(results, key=lambda r: r[0])
+    return efficiency, [stimuli[i] for i in order], [int(i) for i in itis]
+
+
+def designFileName(subj_id, run_number, design_dir='designs'):
+    return os.path.join(design_dir, "sub-%s_run-%s_design.tsv" % (subj_id, run_number))
+
+
+def writeDesign(subj_id, run_number, ordered_stimuli, itiTimes, design_dir='designs'):
+    if not os.path.isdir(design_dir):
+        os.makedirs(design_dir)
+    fname = designFileName(subj_id, run_number, design_dir)
+    with open(fname, 'w') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['trial', 'iti', 'valence', 's_ns', 'id', 'msg_id'])
+        for tidx, (stim, iti) in enumerate(zip(ordered_stimuli, itiTimes)):
+            writer.writerow([tidx + 1, iti, stim['valence'], stim['s_ns'], stim['id'], stim['msg_id']])
+    return fname
+
+
+def loadDesign(subj_id, run_number, design_dir='designs'):
+    '''
+    Returns (msg_ids in presentation order, ITIs) from the subject's
+    design file for this run, or None if there isn't one
+    '''
+    fname = designFileName(subj_id, run_number, design_dir)
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        rows = [row for row in csv.DictReader(f, delimiter='\t')]
+    return [row['msg_id'] for row in rows], [float(row['iti']) for row in rows]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write efficiency-optimized message task schedules")
+    parser.add_argument('subjects', nargs='+', help="subject IDs, as entered in the task dialog")
+    parser.add_argument('--runs', nargs='+', default=['01', '02'])
+    parser.add_argument('--candidates', type=int, default=20000, help="designs to evaluate per run")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--tr', type=float, default=2.0)
+    args = parser.parse_args()
+
+    bank = StimulusBank(args.runs)
+    for subj_raw in args.subjects:
+        subj_id = subj_raw.zfill(3)  ## Same padding as checkID()
+        for run_number in args.runs:
+            seed = int(subj_id) * 100 + int(run_number)
+            efficiency, ordered, itiTimes = optimizeDesign(bank.getRuns(run_number), seed, n_candidates=args.candidates,
+                                                          n_workers=args.workers, tr=args.tr)
+            fname = writeDesign(subj_id, run_number, ordered, itiTimes)
+            print("%s: efficiency %.4f" % (fname, efficiency))
@@ -6,6 +6,12 @@ import csv, datetime
 from numpy import random
 from random import shuffle
 from CustomRatingScale import CustomRatingScale
+from EventLogWriter import EventLogWriter
+from StimulusBank import StimulusBank
+from MediaPrefetcher import MediaPrefetcher
+from design_optimizer import loadDesign
+from TriggerListener import TriggerListener, SharedKeyboard
+from trial_schedule import buildTimeline, validateTimeline, drawUntil
 import os.path
 
 
@@ -17,8 +23,31 @@ import os.path
 ##    Message   8 sec
 ##    Relevance rating   5 sec
 ## Fixation (iti) timings set in getFixations(),
-##    with a uniform distribution between 2 sec and 6 sec
+##    with a uniform distribution between 2 sec and 6 sec,
+##    unless design_optimizer.py wrote a schedule for this subject/run
+##    (designs/sub-XXX_run-XX_design.tsv: fixed trial order and ITIs)
 ## Number of trials:   40 per run
+## Choose 'both' as the run number to do runs 01 and 02 back to back
+##    in one session (one window; each run waits for its own trigger)
+## Onsets are scheduled as absolute times from the scanner trigger
+##    (see trial_schedule.py), so timing errors do not accumulate
+## Rating keys are timestamped by the keyboard device when
+##    useHighResKeyboard is True (falls back to frame-based event keys)
+## Pictograms (images/<msg_id>.png) and audio (audio/<msg_id>.wav)
+##    are shown/played with each message when useMultimedia is True;
+##    they are decoded prefetchTrials trials ahead, on a worker thread
+## Every scanner trigger during the run is timestamped when recordTriggers
+##    is True (sub-XXX_..._triggers.tsv); the events TSV then also has each
+##    onset in scanner time (tr_onset). With resyncToTR, planned onsets are
+##    taken as scanner times, so phases follow the scanner's clock
+
+useHighResKeyboard = True
+useMultimedia = False
+prefetchTrials = 3
+prefetchTimeout = 0.5  ## sec to wait for the worker before decoding on the main thread
+TR = 2.0  ## sec
+recordTriggers = True
+resyncToTR = False
 
 
 def checkID(subj_id):
@@ -68,6 +97,34 @@ def drawThanks():
     thanks2.draw()
 
 
+def getKeyboard():
+    # Device-level keyboard (psychtoolbox backend) that timestamps key
+    # presses at sub-millisecond resolution, independent of the frame loop;
+    # returns None if unavailable, so the scale falls back to event.getKeys;
+    # shares a lock with the trigger listener's thread (see TriggerListener.py)
+    if not useHighResKeyboard:
+        return None
+    try:
+        from psychopy.hardware import keyboard
+        return SharedKeyboard(keyboard.Keyboard())
+    except Exception as e:
+        logging.warning('High-resolution keyboard unavailable (%s); using frame-based keys' % e)
+        return None
+
+
+def getTriggerListener():
+    # Background listener for scanner triggers (see TriggerListener.py);
+    # needs its own device-level keyboard, returns None if unavailable
+    if not recordTriggers:
+        return None
+    try:
+        from psychopy.hardware import keyboard
+        return TriggerListener(SharedKeyboard(keyboard.Keyboard()), TR)
+    except Exception as e:
+        logging.warning('Scanner triggers will not be recorded (%s)' % e)
+        return None
+
+
 def getScale():  ## CURRENTLY UNUSED
     # Built-in scale
     scale = visual.RatingScale(win, low = 0, high = 10, markerStart = 5, size = 2, acceptPreText = "5",
@@ -89,7 +146,7 @@ def getCustomScale():
     ## Instantiate and return scale
     scale = CustomRatingScale(win, low = 0, high = 10, markerStart = 5, size = 2, acceptPreText = "5",
                                 textColor = 'White', scale = None, noMouse = True, acceptKeys = None, skipKeys = None,
-                                leftKeys = lKey, rightKeys = rKey)
+                                leftKeys = lKey, rightKeys = rKey, keyboard = kb)
 
     return scale
 
@@ -116,24 +173,24 @@ def drawInstructions():
     instruction_text.draw()
 
 
+def getMessageStim(message):
+    # Message text (image above it, if used); one per message, made by the stimulus bank
+    messageStim = visual.TextStim(win, text=message, pos=(0,5.5), color="#FFFFFF", wrapWidth=20, alignHoriz = 'center',
+                                  height=1.25)
+    return messageStim
+
+
 def getRuns(run_number):
-    # Load messages from the CSV file into a list of dictonaries:
+    # Get messages for this run from the preloaded stimulus bank
+    # (StimulusBank.py) as a list of dictonaries:
     ## One for each msg, keys match column headers...
     ## [ {'s_ns': social/nonsoc, 
     ##    'valence': positive/negative, 
     ##    'id': msg ID#, 
+    ##    'msg_id': 'pos_soc_419',
     ##    'message': 'You are more likely...', etc.} ]
 
-    stimFile = "stimuli_%s.csv" % (run_number)
-    stimuli  = [i for i in csv.DictReader(open(stimFile,'rU'))]
-
-    # Get runs to set up trial handler
-    runs = []
-
-    for i in range(len(stimuli)):
-        runs.append(stimuli[i])
-
-    return runs
+    return bank.getRuns(run_number)
 
 
 def getFixations(run_num):
@@ -151,8 +208,30 @@ def getFixations(run_num):
     return itiTimes
 
 
+def prepareRun(run_number):
+    # Load everything a run needs before any run starts, so
+    # consecutive runs only wait for the scanner trigger
+    runs = getRuns(run_number)
+
+    design = loadDesign(subj_id, run_number)
+    if design is not None:
+        # Optimized schedule: present messages in its order, with its ITIs
+        msgOrder, itiTimes = design
+        runsById = dict((stim['msg_id'], stim) for stim in runs)
+        runs = [runsById[msg_id] for msg_id in msgOrder]
+        method = "sequential"
+    else:
+        itiTimes = None  ## do_run uses getFixations()
+        method = "random"
+
+    trials = data.TrialHandler(runs, nReps = 1, dataTypes = ['stim_onset', 'resp_onset', 'rt', 'resp'], method = method)
+    scales = [getCustomScale() for t in range(trials.nTotal)]  ## One fresh scale per trial
+
+    return {'run': run_number, 'trials': trials, 'scales': scales, 'itiTimes': itiTimes}
+
+
 # Do run
-def do_run(run_number, trials):
+def do_run(run_number, trials, scales=None, itiTimes=None):
     # Set up CSV data file
     runNumStr = str(run_number)
     if len(runNumStr) < 2:
@@ -160,11 +239,9 @@ def do_run(run_number, trials):
 
     csvName_noPath = "sub-%s_task-HealthMessageTask_run-%s_events.tsv" % (subj_id, runNumStr)
     csvName = os.path.join("logs", csvName_noPath)
-    csvFile = open(csvName, 'w')
-    csvWriter = csv.writer(csvFile, delimiter='\t')
-
-    csvWriter.writerow(['onset', 'duration', 'trial', 'trial_type', 'rating', 'resp_time', 'valence', 's_ns', 'id'])
-    indDic = {'onset' : 0, 'duration' : 1, 'trial_num': 2, 'trial_type' : 3, 'rating': 4, 'resp_time': 5, 'valence': 6, 's_ns': 7, 'id': 8}
+    ## Rows are written and flushed on a background thread (see EventLogWriter.py)
+    csvWriter = EventLogWriter(csvName, ['onset', 'duration', 'trial', 'trial_type', 'rating', 'resp_time', 'valence', 's_ns', 'id', 'planned_onset', 'tr_onset'])
+    indDic = {'onset' : 0, 'duration' : 1, 'trial_num': 2, 'trial_type' : 3, 'rating': 4, 'resp_time': 5, 'valence': 6, 's_ns': 7, 'id': 8, 'planned_onset': 9, 'tr_onset': 10}
     dataListLength = len( indDic.keys() )
 
     # Set up log file
@@ -186,6 +263,28 @@ def do_run(run_number, trials):
     # Set up dictionary of duration values
     durations = getDurations(frame_rate = 1)  ## Default: frame_rate = 1
 
+    # Compute the whole run timeline up front and check it before scanning
+    ##itiTimes = getFixations(len(trials.trialList))  ## to have number of ITIs not pre-determined
+    if itiTimes is None:
+        itiTimes = getFixations(run_number)
+    timeline = buildTimeline(itiTimes, durations)
+    runLength = validateTimeline(timeline, durations, n_trials = trials.nTotal)
+    logging.info('Planned run %s length: %.1f sec' % (run_number, runLength))
+
+    # Set up message screen (image and message will change repeatedly):
+    ##             IMAGE
+    ##
+    ##            message
+
+    if useMultimedia:
+        from psychopy import sound
+        pictureStim = visual.ImageStim(win, pos=(0,6.5), size=(12.6,9.2) )
+        prefetcher = MediaPrefetcher(max_items = 2 * (prefetchTrials + 1))
+        trialOrder = [trials.trialList[i]['msg_id'] for i in trials.sequenceIndices.flatten('F')]
+        prefetcher.prefetch(trialOrder[:prefetchTrials + 1])
+    ## Message stimuli are laid out in advance by the stimulus bank (see getMessageStim)
+    questionStim = visual.TextStim(win, text='How motivating is this statement to you?', pos=(0,-0.5), color="#FFFFFF", wrapWidth=20)
+
     # --------- Instructions begin ---------
 
     # Show instructions
@@ -198,6 +297,9 @@ def do_run(run_number, trials):
 
     event.waitKeys(keyList=('space'))
 
+    # Set up the trigger listener now, so starting it at the trigger takes no time
+    listener = getTriggerListener()
+
     # Display "ready" screen and wait for 'T' to be sent to indicate scanner trigger
     drawReady()
     win.flip()
@@ -208,26 +310,26 @@ def do_run(run_number, trials):
     # time starts when stabilizing screen shows
     
     globalClock.reset()
-    
-    while globalClock.getTime() < durations['stabilize']:
-        drawStabilizeScreen()
-        win.flip()
 
-    # Send START log event
-    logging.log(level=logging.DATA, msg='******* START (trigger from scanner) - run %s *******' % run_number)
+    # Timestamp the rest of the scanner triggers (on globalClock) from here on
+    if listener is not None:
+        listener.start(globalClock)
 
-    # Set up message screen (image and message will change repeatedly):
-    ##             IMAGE
-    ##
-    ##            message
+    def clockTarget(planned):
+        # Planned onsets are scanner times when resynchronizing to the TR grid
+        if resyncToTR and listener is not None:
+            return listener.toClockTime(planned)
+        return planned
 
-    ##pictureStim = visual.ImageStim(win, pos=(0,6.5), size=(12.6,9.2) )
-    messageStim = visual.TextStim(win, text='', pos=(0,5.5), color="#FFFFFF", wrapWidth=20, alignHoriz = 'center')
-    messageStim.height = 1.25
-    questionStim = visual.TextStim(win, text='How motivating is this statement to you?', pos=(0,-0.5), color="#FFFFFF", wrapWidth=20)
+    def scanTime(onset):
+        if listener is None:
+            return ""
+        return listener.toScanTime(onset)
+    
+    drawUntil(win, globalClock, clockTarget(durations['stabilize']), drawStabilizeScreen)
 
-    ##itiTimes = getFixations(len(trials.trialList))  ## to have number of ITIs not pre-determined
-    itiTimes = getFixations(run_number)
+    # Send START log event
+    logging.log(level=logging.DATA, msg='******* START (trigger from scanner) - run %s *******' % run_number)
 
     # --------- MAIN LOOP - present trials ---------
 
@@ -235,78 +337,85 @@ def do_run(run_number, trials):
         # Prepare to write CSV data for this trial
         dataList = [""] * dataListLength
         dataList[indDic['trial_num']] = tidx + 1
+        trialTimes = timeline[tidx]
 
         # Get stimuli for this trial
         valence = trial['valence']  ## "positive" or "negative"
         s_ns = trial['s_ns']  ## "social" or "nonsocial"
-        id = valence[0:3] + "_" + s_ns[:-3] + "_" + trial['id']
+        id = trial['msg_id']
         dataList[indDic['valence']] = valence
         dataList[indDic['s_ns']] = s_ns
         dataList[indDic['id']] = id
 
 
-        ##image_noPath = "%s_%s.png" % (theme, trial_type)
-        ##image = os.path.join('images', cond, image_noPath)
-        ##audio_noPath = "%s_%s_%s.wav" % (theme, trial_type, cond)
-        ##audio = os.path.join('audio', audio_noPath)
-
-        ##message = trial['message']  ## If quotes desired
-        message = trial['message'].strip('"')  ## If quotes not desired
-
-        ##pictureStim.setImage(image)
-        messageStim.setText(message)
+        ## Quotes are stripped from messages by the stimulus bank
+        messageStim = bank.getMessageStim(trial)
 
         # send FIXATION log event
         logging.log(level=logging.DATA, msg='FIXATION')
-        iti_onset = globalClock.getTime()
-
-        # show fixation
-        timer.reset()
 
-        this_iti = itiTimes.pop()
-        while timer.getTime() < this_iti:  ##while timer.getTime() < fixation_for_trial:  ###for frame in range(durations['fixation']):
-            drawCross()
-            win.flip()
+        # show fixation until the message is due
+        this_iti = trialTimes['iti']
+        if useMultimedia:
+            # first fixation frame, then (while the cross is up) queue decoding of
+            # the next trials and turn this trial's decoded media into a texture/sound
+            iti_onset = drawUntil(win, globalClock, 0, drawCross)  ## Target already passed: one flip
+            prefetcher.prefetch(trialOrder[tidx + 1:tidx + 1 + prefetchTrials])
+            try:
+                media = prefetcher.get(id, timeout = prefetchTimeout)
+            except RuntimeError as e:
+                logging.warning('%s; decoding now' % e)
+                media = prefetcher.load(id)
+            for e in media['errors']:
+                logging.warning('Media for %s could not be loaded (%s)' % (id, e))
+            showPicture = media['image'] is not None
+            if showPicture:
+                pictureStim.setImage(media['image'])
+            messageSound = None
+            if media['audio'] is not None:
+                samples, sampleRate = media['audio']
+                messageSound = sound.Sound(value = samples, sampleRate = sampleRate)
+            drawUntil(win, globalClock, clockTarget(trialTimes['message_onset']), drawCross)
+        else:
+            iti_onset = drawUntil(win, globalClock, clockTarget(trialTimes['message_onset']), drawCross)
 
         # send MESSAGE log event
         ##logging.log(level = logging.DATA, msg = "MESSAGE: %s - %s - %s" % (cond, theme, trial_type))
 
-        stim_onset = globalClock.getTime()
-        trials.addData('stim_onset', stim_onset)
+        # show mesage until the rating is due
+        def drawMessage():
+            if useMultimedia and showPicture:
+                pictureStim.draw()
+            messageStim.draw()
 
-        # show mesage 
-        timer.reset()
+        if useMultimedia and messageSound is not None:
+            win.callOnFlip(messageSound.play)  ## Starts with the first message frame
 
-        while timer.getTime() < durations['message']:  ##for frame in range(durations['message']):
-            ##pictureStim.draw()
-            messageStim.draw()
-            win.flip()
-            if 'escape' in event.getKeys():
-                core.quit()
+        stim_onset = drawUntil(win, globalClock, clockTarget(trialTimes['rating_onset']), drawMessage, escapeKeys = ['escape'])
+        trials.addData('stim_onset', stim_onset)
 
         # send SHOW RATING log event
         logging.log(level = logging.DATA, msg = "SHOW RATING")
 
-        choice_onset = globalClock.getTime()
-        trials.addData('resp_onset', choice_onset)
-
-        # clear event buffer and get time
+        # clear event buffer
         event.clearEvents()
-        resp_onset = globalClock.getTime()
 
-        # show rating and collect response  
-        timer.reset()
+        # show rating and collect response until the next trial is due
+        if scales is not None:
+            scale = scales[tidx]
+        else:
+            scale = getCustomScale()
 
-        scale = getCustomScale()
-        while timer.getTime() < durations['rating']:  ##for frame in range(durations['rating']):
-            ##pictureStim.draw()
+        def drawRating():
+            if useMultimedia and showPicture:
+                pictureStim.draw()
             messageStim.draw()
             questionStim.draw()
             scale.draw()
             drawAnchors()
-            win.flip()
-        if 'escape' in event.getKeys():
-            core.quit()
+
+        choice_onset = drawUntil(win, globalClock, clockTarget(trialTimes['end']), drawRating, escapeKeys = ['escape'])
+        trials.addData('resp_onset', choice_onset)
 
         # get key response
         allRatings = scale.getHistory()  ## List of tuples
@@ -318,29 +427,41 @@ def do_run(run_number, trials):
         trials.addData('resp',resp_value)
         trials.addData('rt', rt)
 
-        # Write trial data to CSV file and flush
+        # Queue trial data for the CSV file
         dataList[indDic['rating']] = resp_value
         dataList[indDic['resp_time']] = rt
 
         dataList[indDic['trial_type']] = 'iti'
         dataList[indDic['onset']] = iti_onset
+        dataList[indDic['planned_onset']] = trialTimes['iti_onset']
+        dataList[indDic['tr_onset']] = scanTime(iti_onset)
         dataList[indDic['duration']] = this_iti
         csvWriter.writerow(dataList)
 
         dataList[indDic['trial_type']] = 'message'
         dataList[indDic['onset']] = stim_onset
+        dataList[indDic['planned_onset']] = trialTimes['message_onset']
+        dataList[indDic['tr_onset']] = scanTime(stim_onset)
         dataList[indDic['duration']] = durations['message']
         csvWriter.writerow(dataList)
 
         dataList[indDic['trial_type']] = 'rating'
         dataList[indDic['onset']] = choice_onset
+        dataList[indDic['planned_onset']] = trialTimes['rating_onset']
+        dataList[indDic['tr_onset']] = scanTime(choice_onset)
         dataList[indDic['duration']] = durations['rating']
         csvWriter.writerow(dataList)
 
-        csvFile.flush()
-
     drawThanks()
     win.flip()
+
+    # Finish writing the CSV file (and the triggers sidecar) while the thank-you screen is up
+    csvWriter.close()
+    if listener is not None:
+        listener.stop()
+        listener.writeSidecar(csvName.replace('_events.tsv', '_triggers.tsv'))
+    if useMultimedia:
+        prefetcher.close()
     core.wait(3)
 
 
@@ -359,9 +480,6 @@ def do_run(run_number, trials):
     ##trials.saveAsText(log_filename2, delim=',', dataOut=('n', 'all_raw'))
     ##trials.saveAsText(log_filename2, delim=',', dataOut=['resp_onset_raw', 'resp_raw', 'rt_raw', 'stim_onset_raw', 'order_raw'])
 
-    # Quit
-    core.quit()
-
 
 # ==================================
 # MAIN - set up trials and do run(s)
@@ -371,7 +489,7 @@ if __name__ == '__main__':
     subjDlg = gui.Dlg(title="Health Message Task")
     subjDlg.addField('Enter Subject ID:')
     subjDlg.addField('Select dominant hand:', choices = ['right', 'left'])
-    subjDlg.addField('Select Run Number:', choices = ['01', '02'])
+    subjDlg.addField('Select Run Number:', choices = ['01', '02', 'both'])
     subjDlg.show()
     if subjDlg.OK: ## If "OK" is pressed
         subj_id_raw = subjDlg.data[0]
@@ -381,13 +499,27 @@ if __name__ == '__main__':
         core.quit()
 
     # Initialize global variables; set Full Screen T/F (win)
-    global win, mouse, subj_id, r_handed
+    global win, mouse, subj_id, r_handed, kb, bank
     win = visual.Window([1024,768], fullscr = True, monitor='testMonitor', units='deg') 
     mouse = event.Mouse(visible = True)
     subj_id = checkID(subj_id_raw)
     r_handed = ('r' == hand_raw[0])  ## right-handed: True or False
+    kb = getKeyboard()  ## None if high-resolution keyboard is unavailable
 
     # Run(s)
-    runs = getRuns(run_num)
-    trials = data.TrialHandler(runs, nReps = 1, dataTypes = ['stim_onset', 'resp_onset', 'rt', 'resp'], method = "random")
-    do_run(run_num, trials)  ## First input argument is run number
+    if run_num == 'both':
+        run_nums = ['01', '02']
+    else:
+        run_nums = [run_num]
+
+    ## Load, check, and lay out all messages once (raises ValueError if the stimuli are invalid)
+    bank = StimulusBank(run_nums)
+    bank.prepareText(getMessageStim)
+
+    ## Preload all runs up front, then do them back to back in this window
+    preparedRuns = [prepareRun(r) for r in run_nums]
+    for prepared in preparedRuns:
+        do_run(prepared['run'], prepared['trials'], prepared['scales'], prepared['itiTimes'])  ## First input argument is run number
+
+    # Quit
+    core.quit()
@@ -0,0 +1,43 @@
+from __future__ import absolute_import, division, print_function
+
+from trial_schedule import drawUntil
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.time = 0.0
+
+    def getTime(self):
+        return self.time
+
+
+class FakeWindow(object):
+    '''Flips land exactly one frame apart on the clock'''
+
+    def __init__(self, clock, framePeriod=1 / 60.0, firstFlip=0.0):
+        self.clock = clock
+        self.monitorFramePeriod = framePeriod
+        self.nextFlip = firstFlip
+
+    def flip(self):
+        self.clock.time = self.nextFlip
+        self.nextFlip += self.monitorFramePeriod
+
+
+def test_next_phase_starts_on_flip_nearest_target():
+    framePeriod = 1 / 60.0
+    for offset in [0.0, 0.24, 0.5, 0.76]:  ## Frame phase relative to the targets
+        clock = FakeClock()
+        win = FakeWindow(clock, framePeriod, firstFlip=offset * framePeriod)
+        target = 0.0
+        for phase in range(50):
+            target += 0.37 + phase * 0.011
+            drawUntil(win, clock, target, lambda: None)
+            ## The following phase's first flip is the next one
+            assert abs(win.nextFlip - target) <= framePeriod / 2.0 + 1e-9
+
+
+def test_returns_first_flip_time():
+    clock = FakeClock()
+    win = FakeWindow(clock, firstFlip=0.005)
+    assert drawUntil(win, clock, 1.0, lambda: None) == 0.005
@@ -0,0 +1,92 @@
+from __future__ import absolute_import, division, print_function
+
+#------------------------------------------------------------
+# TRIAL SCHEDULE - absolute run timeline for the message task
+#------------------------------------------------------------
+## All times are in seconds from the scanner trigger ('t').
+## Every phase ends on the flip nearest its planned target,
+## so overshoot in one phase never carries into the next.
+
+
+def buildTimeline(itiTimes, durations):
+    '''
+    Takes the ITI for each trial (in presentation order) and the
+    dictionary from getDurations(), and returns a list of dictionaries,
+    one per trial, with the planned onsets of each phase:
+    [ {'trial': 1, 'iti': 3, 'iti_onset': 10, 'message_onset': 13,
+       'rating_onset': 21, 'end': 26}, ... ]
+    The first trial starts when the stabilization screen ends
+    '''
+    timeline = []
+    onset = durations['stabilize']
+
+    for tidx, iti in enumerate(itiTimes):
+        trialTimes = {'trial': tidx + 1, 'iti': iti}
+        trialTimes['iti_onset'] = onset
+        trialTimes['message_onset'] = trialTimes['iti_onset'] + iti
+        trialTimes['rating_onset'] = trialTimes['message_onset'] + durations['message']
+        trialTimes['end'] = trialTimes['rating_onset'] + durations['rating']
+        onset = trialTimes['end']
+        timeline.append(trialTimes)
+
+    return timeline
+
+
+def validateTimeline(timeline, durations, n_trials=None, max_run_length=None):
+    '''
+    Checks a timeline from buildTimeline() before the scanner starts;
+    raises ValueError describing every problem found,
+    otherwise returns the planned run length in seconds
+    '''
+    problems = []
+
+    if n_trials is not None and len(timeline) != n_trials:
+        problems.append("%d trials planned but %d stimuli loaded" % (len(timeline), n_trials))
+
+    previousEnd = durations['stabilize']
+    for trialTimes in timeline:
+        if trialTimes['iti'] <= 0:
+            problems.append("trial %d has a non-positive ITI (%s)" % (trialTimes['trial'], trialTimes['iti']))
+        if trialTimes['iti_onset'] != previousEnd:
+            problems.append("trial %d does not start when the previous trial ends" % trialTimes['trial'])
+        previousEnd = trialTimes['end']
+
+    if max_run_length is not None and previousEnd > max_run_length:
+        problems.append("run lasts %.1f s, longer than the %.1f s allowed" % (previousEnd, max_run_length))
+
+    if problems:
+        raise ValueError("Invalid run timeline:\n    " + "\n    ".join(problems))
+
+    return previousEnd
+
+
+def drawUntil(win, clock, target, drawFunc, escapeKeys=None):
+    '''
+    Draws and flips every frame until the flip nearest to target
+    (seconds on clock) is the next one, so the following phase
+    starts on that flip. Returns the clock time of the first flip,
+    i.e. the actual onset of this phase.
+
+    drawFunc is called before every flip; if escapeKeys are given,
+    core.quit() is called as soon as one of them is pressed
+    '''
+    if escapeKeys:
+        from psychopy import core, event
+
+    framePeriod = win.monitorFramePeriod
+    firstFlip = None
+
+    while True:
+        drawFunc()
+        win.flip()
+        now = clock.getTime()
+        if firstFlip is None:
+            firstFlip = now
+        if escapeKeys and event.getKeys(keyList=escapeKeys):
+            core.quit()
+        ## The next flip lands about one frame from now and belongs to
+        ## the following phase if it is within half a frame of the target
+        if now + 1.5 * framePeriod >= target:
+            break
+
+    return firstFlip